@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+'''Generate synthetic nginx access logs resembling those of a conda channel
+server, for benchmarking.
+
+Output is fully determined by the seed and the other parameters, so the
+same command always produces byte-identical logs.'''
+import os
+import gzip
+import argparse
+import datetime as dt
+import numpy as np
+
+# Relative share of requests made to each channel.
+DEFAULT_CHANNELS = {'astroconda': 0.6,
+                    'astroconda-dev': 0.25,
+                    'astroconda-etc': 0.1,
+                    'conda-dev': 0.05}
+# Relative share of requests made by each class of host.
+DEFAULT_HOSTS = {'offsite': 0.7, 'onsite': 0.2, 'infrastructure': 0.1}
+# Kinds of line within the non-garbage traffic, with their relative share.
+REQUEST_KINDS = {'package': 0.55, 'repodata': 0.35, 'other': 0.1}
+PLATFORMS = ['linux-64', 'osx-64', 'noarch']
+PLATFORM_WEIGHTS = [0.55, 0.3, 0.15]
+PYTHONS = ['py36', 'py37', 'py38']
+# Status codes of package downloads and their relative share.
+STATUSES = [200, 302, 304, 404, 206]
+STATUS_WEIGHTS = [0.8, 0.08, 0.06, 0.04, 0.02]
+NAMES = ['astropy', 'numpy', 'scipy', 'matplotlib', 'drizzlepac', 'stsci.tools',
+         'pysynphot', 'synphot', 'photutils', 'jwst', 'crds', 'asdf', 'gwcs',
+         'stwcs', 'calcos', 'hstcal', 'costools', 'reftools', 'acstools',
+         'wfc3tools', 'stsci.image', 'stsci.ndimage', 'stsci.convolve',
+         'specutils', 'ginga', 'imexam', 'pyregion', 'sphinx', 'fitsverify',
+         'cfitsio', 'wcstools', 'ds9', 'iraf-all', 'pyraf', 'stistools',
+         'nictools', 'betadrizzle', 'fitsblender', 'spherical-geometry',
+         'stsci.skypac']
+AGENTS = ['conda/4.7.12 requests/2.22.0 CPython/3.7.4 Linux/3.10.0',
+          'conda/4.6.14 requests/2.21.0 CPython/3.6.8 Darwin/18.7.0',
+          'Wget/1.14 (linux-gnu)',
+          'Mozilla/5.0 (X11; Linux x86_64; rv:68.0) Gecko/20100101']
+INFRA_HOSTS = ['10.0.0.1', '10.0.0.2', '10.0.0.3']
+# Lines that do not match the log format, as left by scanners, clients
+# speaking TLS to the plain HTTP port and lines cut short by rotation.
+GARBAGE = [
+    '\\x16\\x03\\x01\\x02\\x00\\x01\\x00\\x01\\xFC\\x03\\x03',
+    'GET / HTTP/1.1',
+    '-',
+    '',
+    '\\x05\\x01\\x00',
+    '{ip} - - [{date}] "\\x16\\x03\\x01" 400 157 "-" "-"',
+    '{ip} - - [{date}] "GET /astroconda/linux-64/',
+]
+
+
+def config_text():
+    '''Configuration file matching the host layout of the generated logs.'''
+    infra = ''.join(f'  - {ip}\n' for ip in INFRA_HOSTS)
+    return ('internal_host_specs:\n'
+            '  - 10.0.0.0/8\n'
+            '  - 172.17.0.0/16\n'
+            'infrastructure_hosts:\n'
+            f'{infra}')
+
+
+class LogGenerator():
+    '''Produces access log lines from a seeded random number generator.
+
+    channels and hosts map channel names and host classes to their relative
+    share of requests. garbage is the fraction of lines that do not match
+    the log format at all. Off-site and on-site host addresses are drawn
+    from fixed pools with a skewed popularity, so that a few hosts account
+    for much of the traffic as in real logs.'''
+
+    def __init__(self,
+                 seed=0,
+                 channels=DEFAULT_CHANNELS,
+                 hosts=DEFAULT_HOSTS,
+                 garbage=0.02,
+                 offsite_hosts=5000,
+                 onsite_hosts=300):
+        self.rng = np.random.default_rng(seed)
+        self.channels = list(channels)
+        self.channel_p = self.normalize(channels.values())
+        self.host_classes = list(hosts)
+        self.host_p = self.normalize(hosts.values())
+        self.garbage = garbage
+        rng = self.rng
+        self.pools = {
+            'offsite': ['.'.join(str(o) for o in octets) for octets in
+                        zip(rng.integers(11, 223, offsite_hosts),
+                            rng.integers(0, 256, offsite_hosts),
+                            rng.integers(0, 256, offsite_hosts),
+                            rng.integers(1, 255, offsite_hosts))],
+            'onsite': [f'10.{a}.{b}.{c}' if i % 3 else f'172.17.{b}.{c}'
+                       for i, (a, b, c) in enumerate(
+                           zip(rng.integers(1, 256, onsite_hosts),
+                               rng.integers(0, 256, onsite_hosts),
+                               rng.integers(1, 255, onsite_hosts)))],
+            'infrastructure': INFRA_HOSTS,
+            }
+        self.pool_p = {cls: self.zipf_weights(len(pool))
+                       for cls, pool in self.pools.items()}
+        # A fixed catalogue of package files per channel.
+        self.packages = {}
+        for chan in self.channels:
+            files = []
+            for name in NAMES:
+                for _ in range(int(rng.integers(1, 6))):
+                    version = (f'{rng.integers(0, 5)}.{rng.integers(0, 20)}.'
+                               f'{rng.integers(0, 10)}')
+                    platform = rng.choice(PLATFORMS, p=PLATFORM_WEIGHTS)
+                    build = f'{rng.choice(PYTHONS)}_{rng.integers(0, 4)}'
+                    files.append((f'/{chan}/{platform}/'
+                                  f'{name}-{version}-{build}.tar.bz2',
+                                  int(rng.integers(20000, 80000000))))
+            self.packages[chan] = files
+        self.package_p = {chan: self.zipf_weights(len(files))
+                          for chan, files in self.packages.items()}
+
+    @staticmethod
+    def normalize(weights):
+        weights = np.array(list(weights), dtype=float)
+        return weights / weights.sum()
+
+    @staticmethod
+    def zipf_weights(n, s=1.1):
+        return LogGenerator.normalize(1.0 / np.arange(1, n + 1) ** s)
+
+    @staticmethod
+    def pick(u, weights):
+        '''Indices drawn with the given weights, from uniform variates u.'''
+        return np.minimum(np.searchsorted(np.cumsum(weights), u, side='right'),
+                          len(weights) - 1)
+
+    def lines(self, nlines, start, days=1, chunk=100000):
+        '''Yield nlines log lines with timestamps spread in order over the
+        given number of days from the datetime start.'''
+        offsets = np.sort(self.rng.integers(0, int(days * 86400), nlines))
+        for first in range(0, nlines, chunk):
+            yield from self.chunk_lines(offsets[first:first + chunk], start)
+
+    def chunk_lines(self, offsets, start):
+        rng = self.rng
+        n = len(offsets)
+        # All random draws for the chunk are made up front, as arrays.
+        garbage = rng.random(n) < self.garbage
+        chans = self.pick(rng.random(n), self.channel_p)
+        classes = self.pick(rng.random(n), self.host_p)
+        kinds = self.pick(rng.random(n), list(REQUEST_KINDS.values()))
+        u_host = rng.random(n)
+        u_pkg = rng.random(n)
+        statuses = np.array(STATUSES)[self.pick(rng.random(n), STATUS_WEIGHTS)]
+        platforms = self.pick(rng.random(n), PLATFORM_WEIGHTS)
+        agents = rng.integers(0, len(AGENTS), n)
+        templates = rng.integers(0, len(GARBAGE), n)
+        sizes = rng.integers(0, 1000000, n)
+        hostidx = np.zeros(n, dtype=int)
+        for i, cls in enumerate(self.host_classes):
+            sel = classes == i
+            hostidx[sel] = self.pick(u_host[sel], self.pool_p[cls])
+        pkgidx = np.zeros(n, dtype=int)
+        for i, chan in enumerate(self.channels):
+            sel = chans == i
+            pkgidx[sel] = self.pick(u_pkg[sel], self.package_p[chan])
+        kind_names = list(REQUEST_KINDS)
+        others = ['/', '/favicon.ico', '/robots.txt', '/.env', '/wp-login.php']
+
+        for j in range(n):
+            when = start + dt.timedelta(seconds=int(offsets[j]))
+            date = when.strftime('%d/%b/%Y:%H:%M:%S +0000')
+            cls = self.host_classes[classes[j]]
+            ip = self.pools[cls][hostidx[j]]
+            if garbage[j]:
+                yield GARBAGE[templates[j]].format(ip=ip, date=date) + '\n'
+                continue
+            chan = self.channels[chans[j]]
+            kind = kind_names[kinds[j]]
+            if kind == 'package':
+                path, size = self.packages[chan][pkgidx[j]]
+                status = int(statuses[j])
+                if status != 200:
+                    size = int(sizes[j]) % 600
+            elif kind == 'repodata':
+                path = f'/{chan}/{PLATFORMS[platforms[j]]}/repodata.json'
+                status = 304 if sizes[j] % 10 < 3 else 200
+                size = 10000 + int(sizes[j])
+            else:
+                path = others[sizes[j] % len(others)]
+                status = 404
+                size = int(sizes[j]) % 5000
+            yield (f'{ip} - - [{date}] "GET {path} HTTP/1.1" {status} {size} '
+                   f'"-" "{AGENTS[agents[j]]}"\n')
+
+
+def write_log(path, lines, compress=False):
+    '''Write lines to path, gzip compressed if compress is true.'''
+    opener = gzip.open if compress else open
+    with opener(path, 'wt') as f:
+        f.writelines(lines)
+
+
+def generate(outdir,
+             nfiles=1,
+             lines=100000,
+             seed=0,
+             channels=DEFAULT_CHANNELS,
+             hosts=DEFAULT_HOSTS,
+             garbage=0.02,
+             compress=False,
+             start='2019-10-01'):
+    '''Write nfiles daily logs of the given number of lines each into
+    outdir, named like rotated nginx logs, plus a matching config.yml.
+    Returns the list of log paths.'''
+    os.makedirs(outdir, exist_ok=True)
+    gen = LogGenerator(seed, channels, hosts, garbage)
+    day = dt.datetime.strptime(start, '%Y-%m-%d')
+    paths = []
+    for i in range(nfiles):
+        # Logs are rotated the morning after the day they cover.
+        stamp = (day + dt.timedelta(days=1)).strftime('%Y%m%d')
+        path = os.path.join(outdir, f'access.log-{stamp}')
+        if compress:
+            path += '.gz'
+        write_log(path, gen.lines(lines, day), compress)
+        paths.append(path)
+        day += dt.timedelta(days=1)
+    with open(os.path.join(outdir, 'config.yml'), 'w') as f:
+        f.write(config_text())
+    return paths
+
+
+def parse_mix(spec, defaults):
+    '''Parse a mix given as name=weight,name=weight.'''
+    if spec is None:
+        return defaults
+    mix = {}
+    for item in spec.split(','):
+        name, weight = item.split('=')
+        mix[name] = float(weight)
+    return mix
+
+
+def main():
+    ap = argparse.ArgumentParser(
+            description='Generate synthetic conda channel access logs.')
+    ap.add_argument('outdir',
+                    help='Directory to write logs and config.yml into.')
+    ap.add_argument('--files', type=int, default=1,
+                    help='Number of daily log files to write.')
+    ap.add_argument('--lines', type=int, default=100000,
+                    help='Number of lines in each log file.')
+    ap.add_argument('--seed', type=int, default=0,
+                    help='Random seed.')
+    ap.add_argument('--channels',
+                    help='Channel mix, e.g. astroconda=0.7,astroconda-dev=0.3')
+    ap.add_argument('--hosts',
+                    help='Host class mix, e.g. '
+                    'offsite=0.7,onsite=0.2,infrastructure=0.1')
+    ap.add_argument('--garbage', type=float, default=0.02,
+                    help='Fraction of lines not in the log format.')
+    ap.add_argument('--gzip', action='store_true',
+                    help='Write gzip compressed logs.')
+    ap.add_argument('--start', default='2019-10-01',
+                    help='Date covered by the first log, YYYY-MM-DD.')
+    args = ap.parse_args()
+    paths = generate(args.outdir,
+                     nfiles=args.files,
+                     lines=args.lines,
+                     seed=args.seed,
+                     channels=parse_mix(args.channels, DEFAULT_CHANNELS),
+                     hosts=parse_mix(args.hosts, DEFAULT_HOSTS),
+                     garbage=args.garbage,
+                     compress=args.gzip,
+                     start=args.start)
+    for path in paths:
+        print(path)
+
+
+if __name__ == '__main__':
+    main()
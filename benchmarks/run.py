@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+'''Benchmark log parsing, ingest and reporting on synthetic logs.
+
+Each stage is run in a fresh Python process so that its peak resident set
+size is measured in isolation. Results are printed and, with --output,
+written as JSON; --compare prints the change against an earlier result
+file.'''
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+import genlogs
+
+STAGES = ['parse', 'filter', 'ingest', 'reingest', 'report_rollup',
+          'report_raw', 'render']
+
+
+def peak_rss_kb():
+    '''Peak resident set size of this process, in KiB.'''
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS, KiB elsewhere.
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def stage_parse(work):
+    '''Parse every generated log with LogData.process_lines.'''
+    import gzip
+    from conmets.conmets import LogData
+    logdata = LogData(os.path.join(work, 'scratch'))
+    nlines = 0
+    t0 = time.perf_counter()
+    for log in work_logs(work):
+        opener = gzip.open if log.endswith('.gz') else open
+        with opener(log, 'rb') as f:
+            logdata.process_lines(f)
+    elapsed = time.perf_counter() - t0
+    for log in work_logs(work):
+        opener = gzip.open if log.endswith('.gz') else open
+        with opener(log, 'rb') as f:
+            nlines += sum(1 for _ in f)
+    return {'seconds': elapsed, 'lines': nlines}
+
+
+def stage_filter(work):
+    '''LogData.filter_pkgs over all transactions parsed from the logs.
+
+    The logs are parsed without the line prefilter, which would otherwise
+    have removed nearly every row the filter is meant to.'''
+    import gzip
+    from conmets import schema
+    from conmets.conmets import LogData, parse_lines
+    logdata = LogData(os.path.join(work, 'scratch'))
+    frames = []
+    for log in work_logs(work):
+        opener = gzip.open if log.endswith('.gz') else open
+        with opener(log, 'rb') as f:
+            frames.append(parse_lines(f, logdata.chunksize, None)[0])
+    df = schema.concat_frames(frames)
+    t0 = time.perf_counter()
+    out = logdata.filter_pkgs(df)
+    return {'seconds': time.perf_counter() - t0,
+            'rows_in': len(df.index),
+            'rows_out': len(out.index)}
+
+
+def load_classifier(work):
+    import yaml
+    from conmets.hosts import HostClassifier
+    with open(os.path.join(work, 'logs', 'config.yml')) as f:
+        return HostClassifier.from_config(yaml.safe_load(f))
+
+
+def stage_ingest(work, jobs=1):
+    '''read_logs and write_dataset into a new dataset.'''
+    from conmets.conmets import LogData
+    dataset = os.path.join(work, 'dataset')
+    shutil.rmtree(dataset, ignore_errors=True)
+    t0 = time.perf_counter()
+    logdata = LogData(dataset, jobs=jobs, classifier=load_classifier(work))
+    logdata.read_logs(work_logs(work))
+    logdata.write_dataset()
+    return {'seconds': time.perf_counter() - t0}
+
+
+def stage_reingest(work, jobs=1):
+    '''read_logs over the same logs again, i.e. the no-op update.'''
+    from conmets.conmets import LogData
+    t0 = time.perf_counter()
+    logdata = LogData(os.path.join(work, 'dataset'), jobs=jobs,
+                      classifier=load_classifier(work))
+    logdata.read_logs(work_logs(work))
+    logdata.write_dataset()
+    return {'seconds': time.perf_counter() - t0}
+
+
+def stage_report_rollup(work):
+    '''Channel statistics from the rollup tables, as main() computes them by
+    default.'''
+    from conmets.conmets import LogData
+    from conmets.rollup import rollup_stats
+    t0 = time.perf_counter()
+    logdata = LogData(os.path.join(work, 'dataset'),
+                      classifier=load_classifier(work))
+    stats = rollup_stats(logdata.read_rollups())
+    return {'seconds': time.perf_counter() - t0, 'channels': len(stats)}
+
+
+def stage_report_raw(work):
+    '''Channel statistics from the full transaction data, as main() computes
+    them with --raw.'''
+    from conmets.conmets import LogData
+    from conmets.aggregate import channel_stats
+    t0 = time.perf_counter()
+    classifier = load_classifier(work)
+    logdata = LogData(os.path.join(work, 'dataset'), classifier=classifier)
+    data = logdata.data
+    data = data.assign(host_class=classifier.host_class(data['ipaddress']))
+    stats = channel_stats(data, classifier)
+    return {'seconds': time.perf_counter() - t0,
+            'rows': len(data.index),
+            'channels': len(stats)}
+
+
+def stage_render(work, jobs=1):
+    '''Draw every channel chart, from scratch.'''
+    from conmets.conmets import LogData
+    from conmets.rollup import rollup_stats
+    from conmets.render import ChartRenderer, chart_spec
+    logdata = LogData(os.path.join(work, 'dataset'),
+                      classifier=load_classifier(work))
+    stats = rollup_stats(logdata.read_rollups())
+    specs = [chart_spec(chan, s, {}) for chan, s in stats.items()]
+    outdir = os.path.join(work, 'charts')
+    shutil.rmtree(outdir, ignore_errors=True)
+    t0 = time.perf_counter()
+    ChartRenderer(outdir, jobs=jobs).render(specs)
+    return {'seconds': time.perf_counter() - t0, 'charts': len(specs)}
+
+
+def work_logs(work):
+    logdir = os.path.join(work, 'logs')
+    return sorted(os.path.join(logdir, name) for name in os.listdir(logdir)
+                  if name.startswith('access.log'))
+
+
+def run_stage(stage, work, jobs):
+    '''Run one stage in a child process and return its result dict.'''
+    cmd = [sys.executable, os.path.abspath(__file__), '--stage', stage,
+           '--jobs', str(jobs), work]
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, text=True, check=True)
+    # The result is the last line of output; anything before it is
+    # progress messages from conmets itself.
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def child(stage, work, jobs):
+    func = globals()[f'stage_{stage}']
+    kwargs = {'jobs': jobs} if 'jobs' in func.__code__.co_varnames else {}
+    result = func(work, **kwargs)
+    result['peak_rss_kb'] = peak_rss_kb()
+    print(json.dumps(result))
+
+
+def summarize(runs):
+    '''Best (minimum) time of repeated runs, plus the other values of the
+    run achieving it.'''
+    best = dict(min(runs, key=lambda r: r['seconds']))
+    best['runs'] = [r['seconds'] for r in runs]
+    best['peak_rss_kb'] = max(r['peak_rss_kb'] for r in runs)
+    if 'lines' in best:
+        best['lines_per_sec'] = best['lines'] / best['seconds']
+    return best
+
+
+def environment():
+    import numpy
+    import pandas
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=HERE,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL,
+                                text=True).stdout.strip()
+    except(OSError):
+        commit = ''
+    return {'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'numpy': numpy.__version__,
+            'pandas': pandas.__version__,
+            'commit': commit}
+
+
+def compare(old, new):
+    '''Print the ratio of each stage's time and peak memory in new to
+    those in old.'''
+    print(f'{"stage":15s} {"old s":>9s} {"new s":>9s} {"ratio":>7s} '
+          f'{"old MiB":>9s} {"new MiB":>9s}')
+    for stage, result in new['results'].items():
+        if stage not in old['results']:
+            continue
+        before = old['results'][stage]
+        ratio = result['seconds'] / before['seconds']
+        print(f'{stage:15s} {before["seconds"]:9.3f} {result["seconds"]:9.3f} '
+              f'{ratio:7.2f} {before["peak_rss_kb"]/1024:9.1f} '
+              f'{result["peak_rss_kb"]/1024:9.1f}')
+
+
+def main():
+    ap = argparse.ArgumentParser(
+            description='Benchmark conmets on synthetic access logs.')
+    ap.add_argument('workdir', nargs='?',
+                    help='Directory for generated logs and datasets. A '
+                    'temporary directory, removed afterwards, if omitted.')
+    ap.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES,
+                    help='Stages to run.')
+    ap.add_argument('--files', type=int, default=4,
+                    help='Number of daily log files to generate.')
+    ap.add_argument('--lines', type=int, default=250000,
+                    help='Number of lines in each log file.')
+    ap.add_argument('--seed', type=int, default=0,
+                    help='Random seed of the log generator.')
+    ap.add_argument('--garbage', type=float, default=0.02,
+                    help='Fraction of generated lines not in the log format.')
+    ap.add_argument('--gzip', action='store_true',
+                    help='Generate gzip compressed logs.')
+    ap.add_argument('--jobs', '-j', type=int, default=1,
+                    help='Worker processes for ingest and rendering.')
+    ap.add_argument('--repeat', type=int, default=3,
+                    help='Number of times to run each stage; the fastest '
+                    'run is reported.')
+    ap.add_argument('--output', '-o',
+                    help='Write results to this JSON file.')
+    ap.add_argument('--compare',
+                    help='Earlier JSON results to compare against.')
+    ap.add_argument('--stage', help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.stage:
+        return child(args.stage, args.workdir, args.jobs)
+
+    work = args.workdir or tempfile.mkdtemp(prefix='conmets-bench-')
+    params = {'files': args.files, 'lines': args.lines, 'seed': args.seed,
+              'garbage': args.garbage, 'gzip': args.gzip, 'jobs': args.jobs,
+              'repeat': args.repeat}
+    try:
+        logdir = os.path.join(work, 'logs')
+        shutil.rmtree(logdir, ignore_errors=True)
+        t0 = time.perf_counter()
+        genlogs.generate(logdir, nfiles=args.files, lines=args.lines,
+                         seed=args.seed, garbage=args.garbage,
+                         compress=args.gzip)
+        print(f'Generated {args.files} x {args.lines} lines in '
+              f'{time.perf_counter() - t0:.1f}s')
+        results = {}
+        for stage in STAGES:
+            if stage not in args.stages:
+                continue
+            # Report and render stages need the dataset from ingest.
+            if stage not in ('parse', 'filter', 'ingest') and \
+                    not os.path.exists(os.path.join(work, 'dataset')):
+                run_stage('ingest', work, args.jobs)
+            runs = [run_stage(stage, work, args.jobs)
+                    for _ in range(args.repeat)]
+            results[stage] = summarize(runs)
+            rate = results[stage].get('lines_per_sec')
+            print(f'{stage:15s} {results[stage]["seconds"]:8.3f}s '
+                  f'{results[stage]["peak_rss_kb"]/1024:8.1f} MiB'
+                  + (f' {rate:10.0f} lines/s' if rate else ''))
+    finally:
+        if not args.workdir:
+            shutil.rmtree(work, ignore_errors=True)
+
+    report = {'params': params, 'environment': environment(),
+              'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main()
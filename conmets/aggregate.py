@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+import pandas as pd
+from collections import OrderedDict
+
+
+def days_spanned(start_date, end_date):
+    '''Number of days used when averaging over the period start_date to
+    end_date.'''
+    days_elapsed = (end_date - start_date).days
+    if days_elapsed == 0:
+        days_elapsed = 1
+    days_elapsed += 1
+    return days_elapsed
+
+
+def channel_stats(data, classifier):
+    '''Compute download statistics for each conda channel found in data.
+
+    All statistics are produced by a handful of groupby passes over the
+    rows of data rather than by repeatedly masking it per channel and per
+    package name.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        Digested log data as held by LogData.
+        A categorical 'host_class' column, as produced by
+        HostClassifier.host_class, is used if present.
+    classifier : HostClassifier
+        Used to classify the hosts in data if it has no host_class column.
+
+    Returns
+    -------
+    OrderedDict mapping each channel name, in sorted order, to a dict of
+    statistics:
+        start_date, end_date - first and last dates of activity
+        days_elapsed - number of days spanned, as used for averages
+        bydate - Series of downloads per date
+        downloads - total downloads
+        bytes - total bytes transferred
+        unique_hosts - number of distinct IP addresses
+        unique_paths - number of distinct full package paths
+        linux_txns, osx_txns - downloads of linux-64 and osx-64 packages
+        noninf_downloads - downloads by non-infrastructure hosts
+        onsite_hosts, offsite_hosts - number of distinct internal
+            (including infrastructure) and external IP addresses
+        names - list of dicts, one per package name, holding the 'name'
+            and its 'total', 'onsite', 'offsite' and 'infra' downloads,
+            ordered by decreasing total'''
+    stats = OrderedDict()
+    if len(data.index) == 0:
+        return stats
+
+    if 'host_class' in data.columns:
+        host_class = data['host_class']
+    else:
+        host_class = classifier.host_class(data['ipaddress'])
+    internal = host_class != 'offsite'
+    infra = host_class == 'infrastructure'
+    frame = pd.DataFrame({
+        'channel': data['channel'],
+        'date': data['timestamp'].dt.normalize(),
+        'ipaddress': data['ipaddress'],
+        'path': data['path'],
+        'name': data['name'],
+        'size': data['size'],
+        'internal': internal,
+        'linux': data['path'].str.contains('linux-64', regex=False),
+        'osx': data['path'].str.contains('osx-64', regex=False),
+        'noninf': ~infra,
+        # 'on-site' means transactions to non-infrastructure internal hosts.
+        'onsite': host_class == 'onsite',
+        'offsite': host_class == 'offsite',
+        'infra': infra,
+        })
+
+    bychan = frame.groupby('channel', sort=True, observed=True)
+    totals = bychan.agg(start_date=('date', 'min'),
+                        end_date=('date', 'max'),
+                        downloads=('path', 'size'),
+                        bytes=('size', 'sum'),
+                        unique_hosts=('ipaddress', 'nunique'),
+                        unique_paths=('path', 'nunique'),
+                        linux_txns=('linux', 'sum'),
+                        osx_txns=('osx', 'sum'),
+                        noninf_downloads=('noninf', 'sum'))
+    onsite_hosts = frame.loc[frame['internal']].groupby(
+        'channel', observed=True)['ipaddress'].nunique()
+    offsite_hosts = frame.loc[~frame['internal']].groupby(
+        'channel', observed=True)['ipaddress'].nunique()
+    bydate = frame.groupby(['channel', 'date'], sort=True, observed=True).size()
+    byname = frame.groupby(['channel', 'name'], sort=True, observed=True).agg(
+        total=('name', 'size'),
+        onsite=('onsite', 'sum'),
+        offsite=('offsite', 'sum'),
+        infra=('infra', 'sum'))
+
+    # Categorical groups come out in category order; report alphabetically.
+    totals = totals.sort_index(key=lambda idx: idx.astype(str))
+    for chan, row in totals.iterrows():
+        chanstats = {key: row[key] for key in totals.columns}
+        for key in ['downloads', 'bytes', 'unique_hosts', 'unique_paths',
+                    'linux_txns', 'osx_txns', 'noninf_downloads']:
+            chanstats[key] = int(chanstats[key])
+        chanstats['days_elapsed'] = days_spanned(row['start_date'],
+                                                 row['end_date'])
+        chanstats['onsite_hosts'] = int(onsite_hosts.get(chan, 0))
+        chanstats['offsite_hosts'] = int(offsite_hosts.get(chan, 0))
+        chanstats['bydate'] = bydate.loc[chan]
+        chanstats['names'] = [{'name': name,
+                               'total': int(r['total']),
+                               'onsite': int(r['onsite']),
+                               'offsite': int(r['offsite']),
+                               'infra': int(r['infra'])}
+                              for name, r in byname.loc[chan].iterrows()]
+        # Most downloaded first, ties in alphabetical order.
+        chanstats['names'].sort(key=lambda x: (-x['total'], x['name']))
+        stats[chan] = chanstats
+    return stats
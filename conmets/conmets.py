@@ -8,18 +8,31 @@ from math import ceil
 import hashlib
 import gzip
 import socket
+import time
+import numpy as np
 import pandas as pd
 import datetime as dt
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 from dateutil import parser as dpar
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from conmets import schema
+from conmets import readers
+from conmets.store import DatasetStore
+from conmets.resolver import HostnameResolver
+from conmets.manifest import FileManifest, file_entry
+from conmets.rowindex import RowIndex
+from conmets.rollup import rollup, rollup_fingerprint, tables, combine
+from conmets.metrics import Metrics
+from conmets import query
 
 
 def md5(fname):
     hash_md5 = hashlib.md5()
     with open(fname, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
+        for chunk in iter(lambda: f.read(readers.BLOCK_SIZE), b""):
             hash_md5.update(chunk)
     return hash_md5.hexdigest()
 
@@ -30,176 +43,691 @@ patt = '(?P<ipaddress>\\d{1,3}\\.\\d{1,3}\\.\\d{1,3}\\.\\d{1,3}) .* .* \\[(?P<da
         
 logpattern = re.compile(patt)
 
+# Extract simple package titles from 'path' column of data frame.
+dirpattern = re.compile('/.*/.*/')
+namepattern = re.compile('(?P<simplename>.*)-.*-.*\\.tar\\.bz2$')
+
+# Number of parsed lines gathered into column buffers before a DataFrame is
+# built from them.
+DEFAULT_CHUNKSIZE = 100000
+
+
+# Fields gathered from each parsed log line.
+raw_fields = ['ipaddress', 'timestamp', 'path', 'status', 'size', 'name']
+
+
+class LinePrefilter():
+    '''Cheap tests applied to each raw (bytes) log line before any decoding
+    or regex work, rejecting lines that could never yield a package download
+    record.
+
+    A line is rejected if
+        ignored_host - its leading IP address is one of ignore_hosts
+        not_package - it does not mention a .tar.bz2 file
+        status - its HTTP status is not one kept by select_pkgs
+    The number of lines rejected for each reason is kept in counts.'''
+
+    reasons = ['ignored_host', 'not_package', 'status']
+
+    def __init__(self,
+                 ignore_hosts=None,
+                 statuses=(b'200', b'302'),
+                 marker=b'.tar.bz2'):
+        self.ignore_hosts = set(h.encode() for h in ignore_hosts or [])
+        self.statuses = set(statuses)
+        self.marker = marker
+        self.counts = dict.fromkeys(self.reasons, 0)
+
+    def accept(self, line):
+        '''True if line should be passed on for parsing.'''
+        if isinstance(line, str):
+            line = line.encode('utf-8', 'replace')
+        if self.ignore_hosts and line[:line.find(b' ')] in self.ignore_hosts:
+            self.counts['ignored_host'] += 1
+            return False
+        if self.marker not in line:
+            self.counts['not_package'] += 1
+            return False
+        # The status code follows the quoted request: '..." 200 1234 ...'
+        # Lines not of this shape are left for the regex to judge.
+        i = line.find(b'" ')
+        if i >= 0 and line[i+5:i+6] == b' ':
+            if line[i+2:i+5] not in self.statuses:
+                self.counts['status'] += 1
+                return False
+        return True
+
+    def rejected(self):
+        return sum(self.counts.values())
+
+
+def parse_lines(lines,
+                chunksize=DEFAULT_CHUNKSIZE,
+                prefilter=None,
+                metrics=None,
+                source='read'):
+    '''Parse an iterable of access log lines (bytes or str) into a
+    DataFrame having the LogData columns.
+
+    Fields of each matching line are gathered into per-column buffers and a
+    DataFrame is built once per chunk of `chunksize` parsed lines, rather
+    than once per line. If a LinePrefilter is given, lines it rejects are
+    skipped without being decoded or matched against logpattern.
+
+    If a Metrics object is given, the time spent fetching lines is added to
+    its stage named by source ('read' or 'decompress'), the rest to its
+    'parse' stage, and rejected and unparseable lines are counted.
+
+    Returns a tuple of (DataFrame, number of lines read, number of
+    unparseable lines).'''
+    if metrics is not None:
+        fetched = metrics.stages.get(source, {}).get('seconds', 0.0)
+        lines = metrics.timed_lines(lines, source)
+    t0 = time.perf_counter()
+    frames = []
+    buffers = {col: [] for col in raw_fields}
+    nlines = 0
+    unparseable = 0
+    for line in lines:
+        nlines += 1
+        if prefilter is not None and not prefilter.accept(line):
+            continue
+        try:
+            line = line.decode('utf-8')
+        except(AttributeError):
+            pass
+        except(UnicodeDecodeError):
+            unparseable += 1
+            continue
+
+        match = logpattern.match(line)
+        if match is None:
+            unparseable += 1
+            continue
+        path = match.group('path')
+        namematch = namepattern.match(dirpattern.sub('', path))
+        if namematch is None:
+            unparseable += 1
+            continue
+        try:
+            status = int(match.group('status'))
+            size = int(match.group('size'))
+        except(ValueError):
+            unparseable += 1
+            continue
+        buffers['ipaddress'].append(match.group('ipaddress'))
+        buffers['timestamp'].append(
+            f'{match.group("date")}:{match.group("time")}')
+        buffers['path'].append(path)
+        buffers['status'].append(status)
+        buffers['size'].append(size)
+        buffers['name'].append(namematch.group('simplename'))
+        if len(buffers['path']) >= chunksize:
+            frames.append(schema.from_raw(buffers))
+            buffers = {col: [] for col in raw_fields}
+    if buffers['path']:
+        frames.append(schema.from_raw(buffers))
+    df = schema.concat_frames(frames)
+    if metrics is not None:
+        fetched = metrics.stages[source]['seconds'] - fetched
+        metrics.add('parse', time.perf_counter() - t0 - fetched,
+                    nlines, len(df.index))
+        metrics.count('unparseable_lines', unparseable)
+        if prefilter is not None:
+            for reason, n in prefilter.counts.items():
+                metrics.count(f'prefilter_{reason}', n)
+    return(df, nlines, unparseable)
+
+
+def select_window(df, start, end):
+    '''Return the rows of df whose timestamp falls on the dates from start
+    to end, inclusive.
+
+    The rows are located by binary search over a sorted datetime index.
+    Partitioned datasets are read back in date order, so sorting is only
+    needed for frames assembled some other way.'''
+    times = pd.DatetimeIndex(df['timestamp'])
+    if not times.is_monotonic_increasing:
+        df = df.sort_values(by='timestamp', kind='stable')
+        times = pd.DatetimeIndex(df['timestamp'])
+    lo = times.searchsorted(pd.Timestamp(start).normalize(), side='left')
+    hi = times.searchsorted(pd.Timestamp(end).normalize() + pd.Timedelta(days=1),
+                            side='left')
+    return(df.iloc[lo:hi])
+
+
+def select_pkgs(df):
+    '''Return only the rows of df that represent successful (HTTP 200 or
+    302) conda package (.bz2 files) downloads.'''
+    out = df.loc[df['path'].str.contains('bz2')]
+    out = out.loc[out['status'].isin([200, 302])]
+    return(out)
+
+
+def ingest_file(log,
+                chunksize=DEFAULT_CHUNKSIZE,
+                ignore_hosts=None,
+                known_hashes=(),
+                offset=0):
+    '''Hash, decompress and parse a single log file.
+
+    Written as a module-level function so that it may be handed to the
+    worker processes of a process pool by LogData.read_logs.
+
+    Logs are read through conmets.readers: compressed logs are decompressed
+    in a background thread and uncompressed ones memory-mapped, so memory
+    use does not depend on the size of the file. An uncompressed log may be
+    read from byte offset onwards, in which case it is not hashed.
+    Otherwise the file's MD5 hash is computed and, if it is found in
+    known_hashes, the file is not parsed.
+
+    Returns a tuple of (MD5 hash of the file or None, DataFrame of package
+    download transactions or None if the file had already been ingested,
+    FileManifest entry for the file, dict of the Metrics collected).'''
+    metrics = Metrics()
+    entry = file_entry(log)
+    hashval = None
+    if offset == 0:
+        with metrics.stage('hash'):
+            hashval = md5(log)
+        metrics.count('bytes_hashed', entry['size'])
+        if hashval in known_hashes:
+            entry['offset'] = entry['size']
+            return(hashval, None, entry, metrics.as_dict())
+    print(f'Reading log file {log}...')
+    t0 = time.perf_counter()
+    prefilter = LinePrefilter(ignore_hosts)
+    lines = readers.open_lines(log, offset)
+    try:
+        df, nlines, unparseable = parse_lines(
+            lines, chunksize, prefilter, metrics,
+            'decompress' if lines.compressed else 'read')
+    finally:
+        lines.close()
+    if lines.compressed:
+        entry['offset'] = entry['size']
+    else:
+        entry['offset'] = offset + lines.nbytes
+    elapsed = time.perf_counter() - t0
+    rate = nlines / elapsed if elapsed > 0 else 0
+    rejects = ', '.join(f'{k} {v}' for k, v in prefilter.counts.items())
+    print(f'{log}: prefilter rejected {prefilter.rejected()} lines ({rejects})')
+    print(f'{log}: unparseable lines : {unparseable}')
+    print(f'{log}: parsed {nlines} lines in {elapsed:.2f}s ({rate:.0f} lines/s)')
+    # Only package downloads are kept, so return just those to keep the
+    # frame passed back from a worker process small.
+    with metrics.stage('filter', len(df.index)) as st:
+        df = select_pkgs(df)
+        st.rows_out = len(df.index)
+    return(hashval, df, entry, metrics.as_dict())
+
+
 class LogData():
 
-    columns = {
-        'ipaddress': {},
-        'hostname': {},
-        'date': {},
-        'time': {},
-        'path': {},
-        'status': {},
-        'size': {},
-        'name': {}, # derived
-    }
+    # Column types, see conmets.schema
+    columns = schema.columns
 
     def __init__(self,
                  dataset_name,
                  gethostnames=False,
-                 ignore_hosts=[]):
-        '''dataset is a dict
-            dataframe - pandas dataframe containing digested log data
-            file_hashes - MD5 hashes of each file that was read to compose the dataframe'''
+                 ignore_hosts=[],
+                 chunksize=DEFAULT_CHUNKSIZE,
+                 jobs=1,
+                 resolver=None,
+                 classifier=None,
+                 metrics=None,
+                 query_cache=None):
+        '''The dataset is a directory of date-partitioned Parquet files
+        managed by a DatasetStore, whose manifest holds the MD5 hashes of
+        each file that was read to compose it. Only the manifest is read at
+        start-up; the digested log data itself is loaded from disk the first
+        time the data attribute is accessed.
+
+        Timings and counts of each stage of processing are collected in
+        metrics, a Metrics object, if given. Results of query() are kept in
+        query_cache, a query.QueryCache, or in a new in-memory one.'''
         self.dataset_name = dataset_name
-        self.dataset = None
-        self.data = None
         self.digest_path = 'digests'
         self.gethostnames = gethostnames
         self.hostnames = {}
+        self.resolver = resolver
+        self.classifier = classifier
         self.ignore_hosts = ignore_hosts
+        self.chunksize = chunksize
+        self.jobs = jobs
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.query_cache = (query_cache if query_cache is not None
+                            else query.QueryCache())
+        # Read-only view of the dataset as last written, by any process,
+        # from which queries are answered.
+        self.reader = None
+        # Stored data, once loaded, and newly parsed data not yet written.
+        self._data = None
+        self.newdata = []
+        self._folded = 0
 
-        try:
-            print('reading dataset...')
-            with open(self.dataset_name, 'rb')  as f:
-                self.dataset = pickle.load(f)
-        except:
+        if DatasetStore.is_legacy(self.dataset_name):
+            raise ValueError(f'{self.dataset_name} is a single-file dataset. '
+                             'Convert it with convertdata.py before use.')
+        print('reading dataset...')
+        self.store = DatasetStore(self.dataset_name)
+        self.rowindex = RowIndex(self.dataset_name)
+        if not self.store.exists():
             print(f'{self.dataset_name} not found. Creating empty dataset.')
-            with open(self.dataset_name, 'a') as f:
-                self.dataset = {'dataframe':pd.DataFrame(self.columns),
-                                'file_hashes': []}
-        self.data = self.dataset['dataframe']
-        self.hashes = self.dataset['file_hashes']
-
-    def poll_hostnames(self):
-        if ipaddress not in self.hostnames.keys():
-            try:
-                hostname = socket.gethostbyaddr(ipaddress)
-            except:
-                hostname = 'offline'
-            self.hostnames[ipaddress] = hostname
+            self.store.manifest['row_index'] = True
         else:
-            hostname = self.hostnames[ipaddress]
+            self.store.upgrade()
+            if not self.store.manifest.get('row_index'):
+                with self.store.locked():
+                    # Datasets written before the row index existed are
+                    # indexed once, a partition at a time.
+                    if not self.store.manifest.get('row_index'):
+                        print('Indexing existing transactions...')
+                        self.rowindex.rebuild(self.store)
+                        self.store.manifest['row_index'] = True
+                        self.store.write_manifest()
+        self.hashes = self.store.manifest['file_hashes']
+        self.files = FileManifest(self.store.manifest.setdefault('files', {}))
+        if self.gethostnames and self.resolver is None:
+            self.resolver = HostnameResolver(
+                os.path.join(self.dataset_name, 'hostnames.json'))
 
-    def process_lines(self, f):
-        df = pd.DataFrame(self.columns)
-        unparseable = 0
-        for line in f.readlines():
-            try:
-                line = str(line.decode("utf-8"))
-            except(AttributeError):
-                pass
-            # Ignore transactions from particular IP addresses as requested.
-            try:
-                for host in self.ignore_hosts:
-                    if host in line:
-                        continue
-            except(TypeError):
-                pass
+    @property
+    def data(self):
+        '''DataFrame of all digested log data, including any read since the
+        dataset was last written.'''
+        if self._data is None:
+            with self.metrics.stage('load') as st:
+                self._data = self.store.read()
+                if self._data is None:
+                    self._data = schema.empty_frame()
+                st.rows_out = len(self._data.index)
+        if self._folded < len(self.newdata):
+            self._data = schema.concat_frames(
+                [self._data] + self.newdata[self._folded:])
+            self._folded = len(self.newdata)
+        return self._data
 
-            try:
-                match = logpattern.match(line)
-                #print(f'logpattern.match(line): {match}')
-            except:
-                line_errors += 1
-                print(f'Line parse error: {line}')
-                continue
-            try:
-                ipaddress = match.group('ipaddress')
-                date = match.group('date')
-                dateobj = dpar.parse(date)
-                time = match.group('time')
-                path = match.group('path')
-
-                # Extract simple package titles from 'path' column of data frame.
-                patt0 = re.compile('/.*/.*/')
-                patt1 = re.compile('(?P<simplename>.*)-.*-.*\.tar\.bz2$')
-                tarball = re.sub(patt0, '', path)
-                namematch = patt1.match(tarball)
-                name = namematch.group('simplename')
-                status = match.group('status')
-                size = int(match.group('size'))
-                hostname = ''
-                df = df.append({'ipaddress':ipaddress,
-                                'hostname':hostname,
-                                'date':dateobj,
-                                'time':time,
-                                'path':path,
-                                'status':status,
-                                'size':size,
-                                'name':name},
-                                ignore_index=True)
-            except(AttributeError):
-                unparseable += 1
+    def read_window(self, start, end):
+        '''Return a DataFrame of the data dated from start to end,
+        inclusive.
+
+        If the full dataset has not yet been loaded only the date partitions
+        overlapping the window are read from disk.'''
+        start = pd.Timestamp(start)
+        end = pd.Timestamp(end)
+        if self._data is not None:
+            return(select_window(self.data, start, end))
+        first = start.strftime('%Y-%m-%d')
+        last = end.strftime('%Y-%m-%d')
+        dates = [d for d in self.store.partitions() if first <= d <= last]
+        with self.metrics.stage('load') as st:
+            frames = [self.store.read(dates)] + self.newdata
+            df = schema.concat_frames([f for f in frames if f is not None])
+            st.rows_out = len(df.index)
+        return(select_window(df, start, end))
+
+    def poll_hostnames(self, df):
+        '''Return a copy of df with empty entries of its hostname column
+        filled in by reverse-DNS lookups of each distinct IP address.'''
+        missing = (df['hostname'] == '').to_numpy()
+        if not missing.any():
+            return(df)
+        ips = pd.unique(df['ipaddress'].to_numpy()[missing])
+        print(f'Resolving hostnames of {len(ips)} hosts...')
+        self.hostnames.update(self.resolver.resolve(schema.uint32_to_ip(ips)))
+        resolved = pd.Series(schema.uint32_to_ip(ips)).map(self.hostnames)
+        lookup = pd.Series(resolved.to_numpy(), index=ips)
+        hostnames = np.array(df['hostname'], dtype=object)
+        hostnames[missing] = lookup.reindex(
+            df['ipaddress'].to_numpy()[missing]).to_numpy()
+        df = df.copy()
+        df['hostname'] = schema.categorize(hostnames)
+        return(df)
+
+    def process_lines(self, f):
+        '''Parse all lines of the open log file f into a DataFrame.'''
+        t0 = time.perf_counter()
+        prefilter = LinePrefilter(self.ignore_hosts)
+        df, nlines, unparseable = parse_lines(f,
+                                              chunksize=self.chunksize,
+                                              prefilter=prefilter,
+                                              metrics=self.metrics)
+        elapsed = time.perf_counter() - t0
+        rate = nlines / elapsed if elapsed > 0 else 0
         print(f'unparseable lines : {unparseable}')
+        print(f'parsed {nlines} lines in {elapsed:.2f}s ({rate:.0f} lines/s)')
         return(df)
-    
+
     def read_logs(self, logs):
         '''Accepts:
     
         a list of apache/nginx access log files, either raw or .gz,
-        and parses each that has not already been ingested.'''
+        and parses each that has not already been ingested. Raw logs
+        that have grown since they were last read are parsed from the
+        point previously reached.
+
+        When self.jobs is greater than 1 the files are hashed and parsed in
+        a pool of that many worker processes. Results are merged in sorted
+        file name order regardless of which worker finishes first.'''
     
-        # Create data frame for receiving all log data.
-        newdata = pd.DataFrame(self.columns)
+        # Gather data frames from each log for joining once all are read.
+        frames = []
+        known_hashes = set(self.hashes)
 
+        # Decide from the file manifest which logs need reading, and from
+        # where, before opening any of them.
+        tasks = []
         for log in sorted(logs):
-            # Compute MD5 hash of file and compare to list of files that
-            # have already been parsed. If new, parse, if not, skip.
-            hashval = md5(log)
-            if hashval in self.hashes:
+            action, offset = self.files.plan(log)
+            if action == 'skip':
                 print(f'File {log} already parsed.')
                 continue
-            df = pd.DataFrame(self.columns)
-            setname = re.sub('\.gz$', '', log)
-            setpath = os.path.join(self.digest_path, setname)
-            pklpath = os.path.join(self.digest_path, f'{setname}.pkl')
-            print(f'Reading log file {log}...')
-            if '.gz' in log:
-                with gzip.open(log, 'r') as f:
-                    df = self.process_lines(f)
-            else:
-                with open(log, 'r') as f:
-                    df = self.process_lines(f)
-            print(f'Added {df.index} transations to dataset. {newdata.shape} for this session.')
-            newdata = newdata.append(df, ignore_index=True)
-            print(newdata.shape)
-            self.hashes.append(hashval)
-
-        # If any new log files were read, filter down to only conda package downloads
-        # Then sort by date.
+            if action == 'resume':
+                print(f'File {log} has grown; resuming from byte {offset}.')
+            tasks.append((log, offset))
+        logs = [log for log, offset in tasks]
+        args = (repeat(self.chunksize),
+                repeat(self.ignore_hosts),
+                repeat(known_hashes),
+                [offset for log, offset in tasks])
+
+        if self.jobs > 1 and len(logs) > 1:
+            pool = ProcessPoolExecutor(max_workers=self.jobs)
+            results = pool.map(ingest_file, logs, *args)
+        else:
+            pool = None
+            results = map(ingest_file, logs, *args)
+
+        try:
+            for log, (hashval, df, entry, stats) in zip(logs, results):
+                self.metrics.merge(stats)
+                # Compare MD5 hash of file to list of files that have already
+                # been parsed, including any read earlier in this session.
+                if df is None or (hashval and hashval in self.hashes):
+                    print(f'File {log} already parsed.')
+                    self.files.record(log, entry)
+                    continue
+                frames.append(df)
+                print(f'Added {len(df.index)} transactions from {log}. '
+                      f'{sum(len(f.index) for f in frames)} for this session.')
+                # Only record the file once its data is in hand.
+                if hashval:
+                    self.hashes.append(hashval)
+                self.files.record(log, entry)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        self.add_data(frames)
+
+    def add_data(self, frames):
+        '''Clean up a list of DataFrames of newly parsed log data and hold
+        the result for writing by write_dataset.
+
+        The frames must already be reduced to package downloads, as those
+        returned by ingest_file are, so that each row is filtered (and
+        counted by the filter stage) only once.'''
+        newdata = schema.concat_frames(frames)
+
         if len(newdata.index) != 0:
-            newdata = self.filter_pkgs(newdata)
-            newdata = newdata.sort_values(by='date')
-            newdata = newdata.drop_duplicates()
-            # Normalize any 'conda-dev' channel names to 'astroconda-dev'
-            newdata = newdata.replace('/conda-dev', '/astroconda-dev', regex=True)
-            # Add newdata to (potentially empty) existing data
-            self.data = self.data.append(newdata, ignore_index=True)
-            self.dataset['dataframe'] = self.data
+            # Drop transactions already in the dataset or in data read
+            # earlier, e.g. from overlapping rotated logs, and repeats
+            # within this batch.
+            with self.metrics.stage('dedupe', len(newdata.index)) as st:
+                newdata = newdata.sort_values(by='timestamp', kind='stable')
+                newdata = self.rowindex.filter(newdata)
+                st.rows_out = len(newdata.index)
+            self.metrics.count('duplicate_rows', st.rows_in - st.rows_out)
+            if self.gethostnames:
+                with self.metrics.stage('hostnames', len(newdata.index)):
+                    newdata = self.poll_hostnames(newdata)
+            # Hold newdata for writing as new partitions of the dataset,
+            # unless all of it was already there.
+            if len(newdata.index) != 0:
+                self.newdata.append(newdata)
+
+    def merge(self, source):
+        '''Add the transactions of the dataset at source, such as a partial
+        dataset made by `conmets digest` on another machine, to this one,
+        along with the hashes of the log files it was made from.
+
+        The part files merged from each source dataset are recorded against
+        its identifier, so merging a source again, after it has been
+        extended, reads only its new part files. Transactions already
+        present are dropped by the row index as for any new data. Call
+        write_dataset() afterwards to store the result.'''
+        other = DatasetStore(source)
+        if not other.exists():
+            raise FileNotFoundError(f'{source} is not a dataset.')
+        source_id = other.manifest.get('id', os.path.abspath(source))
+        if source_id == self.store.manifest.get('id'):
+            print(f'{source} is this dataset; not merging it into itself.')
+            return
+        merged = self.store.manifest.setdefault('merged', {})
+        done = set(merged.get(source_id, []))
+        frames = []
+        newparts = []
+        for date in other.partitions():
+            parts = [part for part in other.manifest['partitions'][date]
+                     if f'{date}/{part}' not in done]
+            if parts:
+                frames.append(other.read_partition(date, parts))
+                newparts += [f'{date}/{part}' for part in parts]
+        print(f'Merging {len(newparts)} new part files '
+              f'({sum(len(f.index) for f in frames)} transactions) '
+              f'from {source}.')
+        self.add_data(frames)
+        for hashval in other.manifest['file_hashes']:
+            if hashval not in self.hashes:
+                self.hashes.append(hashval)
+        # Forget parts the source no longer has, e.g. after it compacted
+        # them, so the record does not grow without bound. Compacted parts
+        # are read again on the next merge; the row index drops their rows.
+        current = {f'{date}/{part}'
+                   for date, parts in other.manifest['partitions'].items()
+                   for part in parts}
+        merged[source_id] = sorted((done & current) | set(newparts))
+
+    def rollups_valid(self):
+        '''True if the stored rollup tables cover the whole dataset and were
+        made with the host classification of self.classifier.'''
+        return (self.classifier is not None and
+                self.store.rollups_fingerprint() ==
+                rollup_fingerprint(self.classifier))
+
+    def rebuild_rollups(self):
+        '''Recompute the rollup tables of the stored dataset from its
+        transaction data, one date partition at a time. Any data not yet
+        written is rolled up when it is.'''
+        with self.store.locked():
+            # Another process may have rebuilt them meanwhile.
+            if self.rollups_valid():
+                return
+            print('Rebuilding rollup tables...')
+            self.store.reset_rollups(rollup_fingerprint(self.classifier))
+            for date in self.store.partitions():
+                df = self.store.read_partition(date)
+                with self.metrics.stage('rollup', len(df.index)):
+                    self.store.append_rollups(rollup(df, self.classifier))
+            self.store.write_manifest()
+
+    def read_rollups(self, start=None, end=None, names=None):
+        '''Return a dict of the rollup tables, or of those listed in names,
+        restricted to the dates from start to end if given. The tables are
+        rebuilt first if they are out of date.'''
+        if self.newdata:
+            self.write_dataset()
+        if not self.rollups_valid():
+            self.rebuild_rollups()
+        with self.metrics.stage('load') as st:
+            rollups = self.store.read_rollups(names or list(tables),
+                                              start, end)
+            st.rows_out = sum(len(t.index) for t in rollups.values()
+                              if t is not None)
+        return rollups
+
+    def query(self,
+              by=(),
+              channels=None,
+              start=None,
+              end=None,
+              host_classes=None,
+              names=None,
+              measures=query.MEASURES):
+        '''Aggregate the downloads in the dataset, optionally restricted to
+        some channels, host classes ('onsite', 'offsite' or
+        'infrastructure') and package names and to the dates from start to
+        end inclusive.
+
+        Only the dataset as written to disk is queried, never data read by
+        this LogData but not yet written, and the dataset is never written
+        to. Each query first checks whether the dataset has been written
+        since the last (e.g. by a running `conmets follow`). Results are
+        memoized in self.query_cache, keyed on the arguments and on a stamp
+        that changes with every write, so they always reflect what is on
+        disk.
+
+        Parameters
+        ----------
+        by : list of strings
+            Columns, from query.DIMENSIONS, to group by. Empty for totals
+            over all selected downloads.
+        channels, host_classes, names : lists of strings
+            Values to restrict the downloads counted to, or None for all.
+        start, end : dates, or None for the first or last date held.
+        measures : list of strings
+            Aggregates, from query.MEASURES, to compute.
+
+        Returns
+        -------
+        DataFrame indexed by the by columns (a single row if by is empty)
+        with one integer column per measure.
+
+        Most queries are answered from the rollup tables. The transaction
+        data of the window is read instead if the rollup tables are out of
+        date (they are rebuilt only by ingest or a report), or for distinct
+        host or path counts per package name, or per host class for
+        paths.'''
+        if self.classifier is None:
+            raise ValueError('A classifier is needed to query a dataset.')
+        by = list(by)
+        measures = list(measures)
+        for col in by:
+            if col not in query.DIMENSIONS:
+                raise ValueError(f'Cannot group by {col}.')
+        for measure in measures:
+            if measure not in query.MEASURES:
+                raise ValueError(f'Unknown measure {measure}.')
+        start = pd.Timestamp(start).normalize() if start is not None else None
+        end = pd.Timestamp(end).normalize() if end is not None else None
+        filters = {'channel': channels,
+                   'host_class': host_classes,
+                   'name': names}
+        filters = {col: sorted(values) if values is not None else None
+                   for col, values in filters.items()}
+        params = ((rollup_fingerprint(self.classifier), tuple(by),
+                   tuple(measures), start, end) +
+                  tuple((col, None if v is None else tuple(v))
+                        for col, v in filters.items()))
+
+        if self.reader is None:
+            self.reader = DatasetStore(self.dataset_name)
+        attempts = 3
+        for attempt in range(attempts):
+            self.reader.refresh()
+            key = self.reader.version() + params
+            result = self.query_cache.get(key)
+            if result is not None:
+                break
+            try:
+                with self.metrics.stage('query') as st:
+                    result = self.compute_query(self.reader, by, filters,
+                                                start, end, measures)
+                    st.rows_out = len(result.index)
+            except(FileNotFoundError):
+                # Parts replaced by a compaction since the manifest was
+                # read. Their replacements are named by the manifest on
+                # disk by now.
+                if attempt == attempts - 1:
+                    raise
+                continue
+            self.query_cache.put(key, result)
+            break
+        # Callers may modify what they are given; the cache keeps its own.
+        return result.copy()
+
+    def compute_query(self, store, by, filters, start, end, measures):
+        '''Answer a query from the dataset held by store, without writing
+        to it.'''
+        if (store.rollups_fingerprint() == rollup_fingerprint(self.classifier)
+                and not query.needs_raw(by, filters, measures)):
+            with self.metrics.stage('load') as st:
+                rollups = store.read_rollups(query.rollup_tables(measures),
+                                             start, end)
+                st.rows_out = sum(len(t.index) for t in rollups.values()
+                                  if t is not None)
+            return query.aggregate_rollups(rollups, by, filters, measures)
+        first = start.strftime('%Y-%m-%d') if start is not None else ''
+        last = end.strftime('%Y-%m-%d') if end is not None else '~'
+        with self.metrics.stage('load') as st:
+            data = store.read([d for d in store.partitions()
+                               if first <= d <= last])
+            if data is None:
+                data = schema.empty_frame()
+            st.rows_out = len(data.index)
+        return query.aggregate_raw(query.query_frame(data, self.classifier),
+                                   by, filters, measures)
 
     def filter_pkgs(self, df):
         '''Filter dataframe df down to just the rows the represent
         successful (HTTP 200) conda package (.bz2 files) downloads.'''
         inlen = len(df)
-        out = df.loc[df['path'].str.contains('bz2')]
-        out = out.loc[(out['status'] == '200') | (out['status'] == '302')]
-        outlen = len(out)
+        with self.metrics.stage('filter', inlen) as st:
+            out = select_pkgs(df)
+            st.rows_out = outlen = len(out)
         print(f'{inlen-outlen} rows removed to leave conda txns only')
         return(out)
 
     def write_dataset(self, dataset_name=None):
-        '''Serialize working dataset and write it to disk using a filename
-        provided, if requested.
+        '''Write data read since the dataset was last written to disk as new
+        date partitions, followed by the updated manifest. Existing
+        partitions are left untouched.
 
 	Parameters
 	----------
 	dataset_name : string
-	    Optional name to use for file when writing working dataset to disk.
-	    If not provided, the current name of the working dataset file will
-            be used.'''
-        if dataset_name:
-            dsname = dataset_name
-        else:
-            dsname = self.dataset_name
-        pickle.dump(self.dataset, open(dsname, 'wb'))
-
+	    Optional name of a new dataset to which the whole working dataset
+	    is written. If not provided, new data is appended to the current
+	    dataset.'''
+        if dataset_name and dataset_name != self.dataset_name:
+            store = DatasetStore(dataset_name)
+            store.append(self.data)
+            store.manifest['file_hashes'] = list(self.hashes)
+            store.write_manifest()
+            return
+        if (not self.newdata and not self.store.modified() and
+                self.store.exists()):
+            # Nothing to write; leave the manifest to any other writer.
+            return
+        with self.store.locked():
+            if self.classifier is not None and not self.store.partitions():
+                # A new dataset starts out with (empty) up to date rollups.
+                self.store.reset_rollups(rollup_fingerprint(self.classifier))
+            for df in self.newdata:
+                with self.metrics.stage('write', len(df.index)):
+                    self.store.append(df)
+                # Keep the rollup tables up to date with each batch, or mark
+                # them as out of date if there is no classifier to build
+                # them.
+                if self.classifier is not None and self.rollups_valid():
+                    with self.metrics.stage('rollup', len(df.index)):
+                        self.store.append_rollups(rollup(df, self.classifier))
+                else:
+                    self.store.manifest['rollups']['fingerprint'] = None
+            self.store.compact(combine)
+            self.store.write_manifest()
+            # The row index is written last: should this be interrupted,
+            # rows may later be let in twice, but are never wrongly dropped.
+            self.rowindex.write()
+        self.newdata = []
+        self._folded = 0
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+import os
+import time
+from conmets.conmets import LinePrefilter, parse_lines, select_pkgs
+from conmets.manifest import current_inode, file_entry
+
+# Default flush triggers: buffered transactions and seconds since last flush.
+DEFAULT_FLUSH_ROWS = 10000
+DEFAULT_FLUSH_INTERVAL = 60
+# Maximum bytes read from a single log on each poll.
+READ_BYTES = 8 * 1024 * 1024
+
+
+def rotated_name(path, inode):
+    '''Name now held, within the directory of path, by the file having the
+    given inode, or None if it is no longer there.'''
+    dirname = os.path.dirname(path) or '.'
+    for item in os.scandir(dirname):
+        try:
+            if item.inode() == inode and item.is_file():
+                return item.path
+        except(OSError):
+            continue
+    return None
+
+
+class FollowedLog():
+    '''State of one live log file being followed.'''
+
+    def __init__(self, path, offset=0):
+        self.path = path
+        self.f = None
+        self.inode = None
+        self.offset = offset
+
+    def open(self, offset=0):
+        self.close()
+        self.f = open(self.path, 'rb')
+        self.inode = os.fstat(self.f.fileno()).st_ino
+        self.offset = offset
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+    def read(self):
+        '''Return the complete lines appended since the last read, at most
+        READ_BYTES at a time.'''
+        self.f.seek(self.offset)
+        buf = self.f.read(READ_BYTES)
+        end = buf.rfind(b'\n') + 1
+        self.offset += end
+        return buf[:end].splitlines(keepends=True)
+
+
+class LogFollower():
+    '''Continuously ingest live access logs into a LogData dataset.
+
+    Each poll reads the lines appended to each log since the previous poll
+    and parses them straight away. Parsed transactions are buffered until
+    flush_rows of them have accumulated or flush_interval seconds have
+    passed, at which point they are written to the dataset as new
+    partitions together with the offsets reached in each log, so a
+    restarted follower resumes where the last flush left off. Since the
+    full dataset is never loaded and the buffer is emptied on every flush,
+    memory use does not grow with running time.
+
+    A log that is rotated (renamed, with a new file created in its place) is
+    read to its end under its new name before following switches to the new
+    file. A log that is truncated is read again from its beginning.'''
+
+    def __init__(self,
+                 logdata,
+                 paths,
+                 flush_rows=DEFAULT_FLUSH_ROWS,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 poll_interval=1.0):
+        self.logdata = logdata
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.poll_interval = poll_interval
+        self.prefilter = LinePrefilter(logdata.ignore_hosts)
+        self.buffer = []
+        self.buffered_rows = 0
+        self.last_flush = time.monotonic()
+        self.stopping = False
+        self.logs = []
+        for path in paths:
+            log = FollowedLog(path)
+            if os.path.exists(path):
+                action, offset = self.logdata.files.plan(path)
+                log.open(offset if action != 'read' else 0)
+            self.logs.append(log)
+
+    def parse(self, lines):
+        if not lines:
+            return
+        df, nlines, unparseable = parse_lines(lines,
+                                              self.logdata.chunksize,
+                                              self.prefilter)
+        df = select_pkgs(df)
+        if len(df.index) != 0:
+            self.buffer.append(df)
+            self.buffered_rows += len(df.index)
+
+    def poll_log(self, log):
+        try:
+            st = os.stat(log.path)
+        except(FileNotFoundError):
+            # Between rotation of the old file and creation of the new one.
+            return
+        if log.f is None:
+            log.open()
+        elif st.st_ino != log.inode:
+            # Rotated: drain the old file, record it under its new name and
+            # start on the new one.
+            while True:
+                lines = log.read()
+                if not lines:
+                    break
+                self.parse(lines)
+            newname = rotated_name(log.path, log.inode)
+            if newname is not None:
+                self.logdata.files.record(
+                    newname, file_entry(newname, log.offset, log.f))
+            print(f'{log.path} rotated.')
+            log.open()
+        elif st.st_size < log.offset:
+            print(f'{log.path} truncated; reading from start.')
+            log.open()
+        self.parse(log.read())
+
+    def flush(self):
+        '''Write buffered transactions and log offsets to the dataset.'''
+        self.logdata.add_data(self.buffer)
+        for log in self.logs:
+            if log.f is None or current_inode(log.path) != log.inode:
+                # Rotated away; recorded on the next poll that finds its
+                # new name.
+                continue
+            # Described from the open file, as the log may have grown
+            # since it was last read.
+            self.logdata.files.record(
+                log.path, file_entry(log.path, log.offset, log.f))
+        self.logdata.write_dataset()
+        if self.buffered_rows:
+            print(f'Flushed {self.buffered_rows} transactions.')
+        self.buffer = []
+        self.buffered_rows = 0
+        self.last_flush = time.monotonic()
+
+    def poll(self):
+        '''Read all logs once and flush if a trigger has been reached.'''
+        for log in self.logs:
+            self.poll_log(log)
+        if (self.buffered_rows >= self.flush_rows or
+                time.monotonic() - self.last_flush >= self.flush_interval):
+            self.flush()
+
+    def stop(self, *args):
+        self.stopping = True
+
+    def run(self, duration=None):
+        '''Poll the logs until stop() is called, the process is
+        interrupted or duration seconds have passed, then flush.'''
+        start = time.monotonic()
+        try:
+            while not self.stopping:
+                self.poll()
+                if duration is not None and time.monotonic() - start >= duration:
+                    break
+                time.sleep(self.poll_interval)
+        except(KeyboardInterrupt):
+            pass
+        finally:
+            self.flush()
+            for log in self.logs:
+                log.close()
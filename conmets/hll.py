@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+import numpy as np
+
+# Number of index bits. A sketch has 2**precision one-byte registers and
+# estimates distinct counts with a relative standard error of about
+# 1.04 / sqrt(2**precision), i.e. 1.6% at the default of 12 (4 KiB).
+DEFAULT_PRECISION = 12
+# Bounds on precision. Above 18 the bits left over from the 64-bit hash to
+# rank each value no longer convert to float64 exactly.
+MIN_PRECISION = 11
+MAX_PRECISION = 18
+
+
+def hash64(values):
+    '''64-bit hashes of an array of integers (e.g. packed IPv4 addresses),
+    using the splitmix64 finalizer.'''
+    x = np.asarray(values).astype(np.uint64)
+    with np.errstate(over='ignore'):
+        x = x + np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def relative_error(precision=DEFAULT_PRECISION):
+    '''Relative standard error of a count estimated by a sketch of the
+    given precision. Roughly 95% of estimates fall within twice this of the
+    true count.'''
+    return 1.04 / np.sqrt(2 ** precision)
+
+
+class HyperLogLog():
+    '''Mergeable sketch estimating the number of distinct integers added
+    to it, in constant memory.
+
+    Each value is hashed; the top precision bits of the hash select a
+    register, which keeps the largest rank (position of the first set bit)
+    seen among the remaining bits. Sketches of the same precision are
+    merged by taking the maximum of each register, giving exactly the sketch
+    of the union of their inputs, so counts for any combination of days,
+    channels or host classes can be had by merging their sketches. See
+    Flajolet et al., "HyperLogLog: the analysis of a near-optimal
+    cardinality estimation algorithm" (2007).'''
+
+    def __init__(self, precision=DEFAULT_PRECISION, registers=None):
+        if not MIN_PRECISION <= precision <= MAX_PRECISION:
+            raise ValueError(f'precision must be from {MIN_PRECISION} to '
+                             f'{MAX_PRECISION}')
+        self.precision = precision
+        self.m = 2 ** precision
+        if registers is None:
+            registers = np.zeros(self.m, dtype=np.uint8)
+        self.registers = registers
+
+    def add(self, values):
+        '''Add an array of integer values to the sketch.'''
+        values = np.asarray(values)
+        if len(values) == 0:
+            return
+        h = hash64(values)
+        idx = (h >> np.uint64(64 - self.precision)).astype(np.intp)
+        rest = h & np.uint64((1 << (64 - self.precision)) - 1)
+        # rest has at most 53 bits, so its float64 exponent is its exact
+        # bit length.
+        bitlen = np.frexp(rest.astype(np.float64))[1]
+        rank = (64 - self.precision - bitlen + 1).astype(np.uint8)
+        np.maximum.at(self.registers, idx, rank)
+
+    def update(self, other):
+        '''Merge another sketch of the same precision into this one.'''
+        if other.precision != self.precision:
+            raise ValueError('Cannot merge sketches of differing precision.')
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self):
+        '''Estimated number of distinct values added.'''
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(int)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            # Small range correction: linear counting of empty registers.
+            estimate = m * np.log(m / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self):
+        return self.registers.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        registers = np.frombuffer(data, dtype=np.uint8).copy()
+        return cls(int(np.log2(len(registers))), registers)
+
+    @classmethod
+    def merged(cls, serialized):
+        '''Sketch of the union of an iterable of serialized sketches, or an
+        empty sketch if there are none.'''
+        out = None
+        for data in serialized:
+            sketch = cls.from_bytes(data)
+            if out is None:
+                out = sketch
+            else:
+                out.update(sketch)
+        return out if out is not None else cls()
+
+
+def sketch_groups(values, groups, precision=DEFAULT_PRECISION):
+    '''Return a list of serialized sketches, one per group, of the integer
+    array values split by groups, a list of integer index arrays into
+    values.'''
+    sketches = []
+    values = np.asarray(values)
+    for indices in groups:
+        sketch = HyperLogLog(precision)
+        sketch.add(values[indices])
+        sketches.append(sketch.to_bytes())
+    return sketches
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+import re
+import json
+import hashlib
+import ipaddress
+import numpy as np
+import pandas as pd
+from conmets import schema
+
+
+def ip_to_int(ip):
+    '''Integer value of a dotted-quad IPv4 address string, or -1 if it is
+    not a valid address.'''
+    try:
+        return int(ipaddress.IPv4Address(ip))
+    except(ValueError):
+        return -1
+
+
+def spec_to_network(spec):
+    '''Interpret an entry of internal_host_specs or infrastructure_hosts as
+    an IPv4 network.
+
+    Accepts a single address ('10.1.2.3'), a CIDR block ('10.0.0.0/8') or a
+    regex anchored prefix of whole octets as used by earlier configuration
+    files ('^10.', '^172.17.'). Returns None if spec is none of these.'''
+    try:
+        return ipaddress.IPv4Network(spec, strict=False)
+    except(ValueError):
+        pass
+    prefix = spec.lstrip('^').replace('\\.', '.').rstrip('.')
+    octets = prefix.split('.')
+    if not 0 < len(octets) <= 4 or not all(o.isdigit() for o in octets):
+        return None
+    padded = octets + ['0'] * (4 - len(octets))
+    try:
+        return ipaddress.IPv4Network(f'{".".join(padded)}/{8*len(octets)}')
+    except(ValueError):
+        return None
+
+
+class HostClassifier():
+    '''Classifies IP addresses as off-site, on-site or on-site
+    infrastructure hosts.
+
+    The host specifications from the configuration file are compiled once
+    into integer address ranges. Infrastructure hosts take precedence over
+    the internal network ranges, so each address falls into exactly one
+    class.'''
+
+    classes = ['offsite', 'onsite', 'infrastructure']
+
+    def __init__(self, internal_host_specs=(), infrastructure_hosts=()):
+        self.specs = {'internal_host_specs': list(internal_host_specs),
+                      'infrastructure_hosts': list(infrastructure_hosts)}
+        self.internal_ranges, self.internal_regexes = \
+            self.compile(internal_host_specs, 'internal_host_specs')
+        self.infra_ranges, self.infra_regexes = \
+            self.compile(infrastructure_hosts, 'infrastructure_hosts')
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.get('internal_host_specs') or [],
+                   config.get('infrastructure_hosts') or [])
+
+    def fingerprint(self):
+        '''Hash of the host specifications, identifying data classified
+        with them.'''
+        encoded = json.dumps(self.specs, sort_keys=True).encode('utf-8')
+        return hashlib.md5(encoded).hexdigest()
+
+    @staticmethod
+    def compile(specs, label):
+        '''Split specs into an (N, 2) array of inclusive integer address
+        ranges and a list of compiled regexes for any that cannot be
+        expressed as networks.'''
+        ranges = []
+        regexes = []
+        for spec in specs:
+            network = spec_to_network(spec)
+            if network is not None:
+                ranges.append((int(network.network_address),
+                               int(network.broadcast_address)))
+                continue
+            try:
+                regexes.append(re.compile(spec if spec.startswith('^')
+                                          else '^'+spec))
+                print(f'{label}: {spec} is not an address or network; '
+                      'matching it as a regex.')
+            except(re.error):
+                print(f'{label}: ignoring unusable entry {spec}')
+        return np.array(ranges, dtype='int64').reshape(-1, 2), regexes
+
+    @staticmethod
+    def match(ips, ipints, ranges, regexes):
+        found = np.zeros(len(ipints), dtype=bool)
+        for lo, hi in ranges:
+            found |= (ipints >= lo) & (ipints <= hi)
+        for regex in regexes:
+            found |= np.array([regex.match(ip) is not None for ip in ips],
+                              dtype=bool)
+        return found
+
+    def classify_unique(self, ips):
+        '''Return an array of class codes, indexing self.classes, for a
+        sequence of distinct IP addresses, given either as strings or packed
+        into integers.'''
+        ips = np.asarray(ips)
+        if np.issubdtype(ips.dtype, np.integer):
+            ipints = ips.astype('int64')
+            ips = schema.uint32_to_ip(ips) if (self.internal_regexes or
+                                              self.infra_regexes) else []
+        else:
+            ips = [str(ip) for ip in ips]
+            ipints = np.array([ip_to_int(ip) for ip in ips], dtype='int64')
+        codes = np.zeros(len(ipints), dtype='int8')
+        internal = self.match(ips, ipints,
+                              self.internal_ranges, self.internal_regexes)
+        infra = self.match(ips, ipints,
+                           self.infra_ranges, self.infra_regexes)
+        codes[internal] = self.classes.index('onsite')
+        codes[infra] = self.classes.index('infrastructure')
+        return codes
+
+    def classify(self, ip):
+        '''Class name of a single IP address.'''
+        return self.classes[self.classify_unique([ip])[0]]
+
+    def host_class(self, ipaddress):
+        '''Return a categorical Series giving the class of each entry in the
+        Series ipaddress. Each distinct address is classified only once.'''
+        codes, uniques = pd.factorize(ipaddress)
+        classcodes = self.classify_unique(uniques)
+        rowcodes = np.where(codes >= 0, classcodes[codes], 0)
+        return pd.Series(pd.Categorical.from_codes(rowcodes, self.classes),
+                         index=ipaddress.index,
+                         name='host_class')
@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+import os
+import json
+
+
+def read_json(path):
+    '''Contents of the JSON file at path, or an empty dict if it is missing
+    or unreadable (e.g. a cache left incomplete by a crash).'''
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except(FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def write_json(path, data):
+    '''Atomically replace the JSON file at path with data.'''
+    dirname = os.path.dirname(path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    tmppath = f'{path}.tmp'
+    with open(tmppath, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmppath, path)
@@ -1,19 +1,175 @@
 import argparse
 from conmets.conmets import *
+from conmets.aggregate import channel_stats
+from conmets.rollup import rollup_stats
+from conmets.hll import relative_error
+from conmets.render import ChartRenderer, chart_spec
+from conmets.hosts import HostClassifier
+from conmets.pypi import PyPICache, DEFAULT_INDEX, DEFAULT_TTL
+from conmets.follow import LogFollower, DEFAULT_FLUSH_ROWS, DEFAULT_FLUSH_INTERVAL
+from conmets.metrics import Metrics
 import yaml
-import urllib.request
-from urllib.error import HTTPError
+import signal
+import cProfile
+
+
+def follow(argv):
+    '''conmets follow: continuously ingest live access logs.'''
+    ap = argparse.ArgumentParser(
+            prog='conmets follow',
+            description='Follow one or more live apache/nginx access logs, '
+            'adding new package downloads to a dataset as they are logged. '
+            'Runs until interrupted.')
+    ap.add_argument('dataset_name', type=str,
+                    help='Name of dataset directory to add transactions to. '
+                    'It will be created if it does not exist.')
+    ap.add_argument('logs',
+                    nargs='+',
+                    help='Log files to follow.')
+    ap.add_argument('--config',
+                    '-c',
+                    help='Configuration file. If given, the daily rollup '
+                    'tables of the dataset are kept up to date as '
+                    'transactions are added.')
+    ap.add_argument('--flushrows',
+                    type=int,
+                    default=DEFAULT_FLUSH_ROWS,
+                    help='Write to the dataset once this many transactions '
+                    'have been collected.')
+    ap.add_argument('--flushinterval',
+                    type=float,
+                    default=DEFAULT_FLUSH_INTERVAL,
+                    help='Write to the dataset at least this often, in '
+                    'seconds.')
+    ap.add_argument('--pollinterval',
+                    type=float,
+                    default=1.0,
+                    help='Seconds to wait between checks for new log lines.')
+    ap.add_argument('--ignorehosts',
+                    '-i',
+                    help='IP addresses of hosts to ignore.',
+                    nargs='+')
+    ap.add_argument('--hostnames',
+                    action='store_true',
+                    help='Resolve the hostname of each host found in the '
+                    'logs.')
+    args = ap.parse_args(argv)
+
+    classifier = None
+    if args.config:
+        with open(args.config, 'r') as f:
+            classifier = HostClassifier.from_config(yaml.safe_load(f))
+    logproc = LogData(args.dataset_name,
+                      gethostnames=args.hostnames,
+                      ignore_hosts=args.ignorehosts,
+                      classifier=classifier)
+    follower = LogFollower(logproc,
+                           args.logs,
+                           flush_rows=args.flushrows,
+                           flush_interval=args.flushinterval,
+                           poll_interval=args.pollinterval)
+    signal.signal(signal.SIGTERM, follower.stop)
+    follower.run()
+
+
+def digest(argv):
+    '''conmets digest: ingest local logs into a partial dataset for merging.'''
+    ap = argparse.ArgumentParser(
+            prog='conmets digest',
+            description='Ingest access logs into a partial dataset, to be '
+            'combined with those of other machines by conmets merge. The '
+            'partial dataset holds only package downloads, along with the '
+            'hashes of the logs they were read from, and may be extended by '
+            'digesting further logs into it.')
+    ap.add_argument('dataset_name', type=str,
+                    help='Name of partial dataset directory. It will be '
+                    'created if it does not exist.')
+    ap.add_argument('logs',
+                    nargs='+',
+                    help='Log files to ingest, raw or compressed. glob '
+                    'syntax is also honored.')
+    ap.add_argument('--ignorehosts',
+                    '-i',
+                    help='IP addresses of hosts to ignore.',
+                    nargs='+')
+    ap.add_argument('--chunksize',
+                    type=int,
+                    default=DEFAULT_CHUNKSIZE,
+                    help='Number of parsed log lines to collect before '
+                    'building a table from them.')
+    ap.add_argument('--jobs',
+                    '-j',
+                    type=int,
+                    default=1,
+                    help='Number of worker processes used to hash and parse '
+                    'new log files in parallel.')
+    args = ap.parse_args(argv)
+
+    files = sorted(name for filespec in args.logs for name in glob(filespec))
+    logproc = LogData(args.dataset_name,
+                      ignore_hosts=args.ignorehosts,
+                      chunksize=args.chunksize,
+                      jobs=args.jobs)
+    logproc.read_logs(files)
+    logproc.write_dataset()
+
+
+def merge(argv):
+    '''conmets merge: combine partial datasets into one.'''
+    ap = argparse.ArgumentParser(
+            prog='conmets merge',
+            description='Add the transactions of any number of partial '
+            'datasets, made by conmets digest, to a dataset. Transactions '
+            'present in more than one partial are kept once, and the log '
+            'file hashes of the partials are added to those of the dataset. '
+            'Merging a partial again adds only what has been digested into '
+            'it since.')
+    ap.add_argument('dataset_name', type=str,
+                    help='Name of dataset directory to merge into. It will '
+                    'be created if it does not exist.')
+    ap.add_argument('partials',
+                    nargs='+',
+                    help='Partial dataset directories to merge.')
+    ap.add_argument('--config',
+                    '-c',
+                    help='Configuration file. If given, the daily rollup '
+                    'tables of the dataset are updated with the merged '
+                    'transactions.')
+    args = ap.parse_args(argv)
+
+    classifier = None
+    if args.config:
+        with open(args.config, 'r') as f:
+            classifier = HostClassifier.from_config(yaml.safe_load(f))
+    logproc = LogData(args.dataset_name, classifier=classifier)
+    # Write after each partial so that only one is held in memory at a time.
+    for partial in args.partials:
+        logproc.merge(partial)
+        logproc.write_dataset()
+
+
+# Sub-commands, selected by the first command line argument. Without one
+# of these conmets ingests log files and produces reports.
+commands = {
+    'follow': follow,
+    'digest': digest,
+    'merge': merge,
+}
+
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] in commands:
+        return commands[sys.argv[1]](sys.argv[2:])
+
     ap = argparse.ArgumentParser(
             prog='conmets',
             description='Parse and digest apache/nginx access logs in either'
             ' raw or .gz format and produce conda package download stats '
             'summaries.')
     ap.add_argument('dataset_name', type=str,
-                    help='Name of dataset file. If file does not exist and'
-                    ' log data file names are provided for parsing, this '
-                    'file will be created.')
+                    help='Name of dataset directory. If it does not exist '
+                    'and log data file names are provided for parsing, this '
+                    'dataset will be created.')
     ap.add_argument('--config',
                     '-c',
                     help='Configuration file used to adjust behavior of the '
@@ -37,8 +193,65 @@ def main():
                     ' Useful for saving time by not reading in transactions '
                     'from security scans, etc.',
                     nargs='+')
+    ap.add_argument('--chunksize',
+                    type=int,
+                    default=DEFAULT_CHUNKSIZE,
+                    help='Number of parsed log lines to collect before '
+                    'building a table from them. Larger values trade memory '
+                    'for parsing speed.')
+    ap.add_argument('--jobs',
+                    '-j',
+                    type=int,
+                    default=1,
+                    help='Number of worker processes used to hash and parse '
+                    'new log files, and to draw charts, in parallel.')
+    ap.add_argument('--hostnames',
+                    action='store_true',
+                    help='Resolve the hostname of each host found in the '
+                    'logs. Results are cached within the dataset.')
+    ap.add_argument('--raw',
+                    action='store_true',
+                    help='Compute statistics from the full transaction data '
+                    'rather than from the daily rollup tables kept with the '
+                    'dataset.')
+    ap.add_argument('--approxhosts',
+                    action='store_true',
+                    help='Estimate the numbers of unique hosts from the '
+                    'HyperLogLog sketches in the rollup tables instead of '
+                    'counting them exactly. Uses much less memory over long '
+                    'windows. Has no effect with --raw.')
+    ap.add_argument('--offline',
+                    action='store_true',
+                    help='Do not query the package index; report PyPI '
+                    'availability from previously cached results only.')
+    ap.add_argument('--profile',
+                    help='Write the time taken and rows processed by each '
+                    'stage of the run, counts of rejected and unparseable '
+                    'log lines and peak memory use to this JSON file.')
+    ap.add_argument('--cprofile',
+                    help='Run under cProfile and write the profile to this '
+                    'file, for inspection with pstats or snakeviz.')
     args = ap.parse_args()
 
+    metrics = Metrics()
+    if args.cprofile:
+        profiler = cProfile.Profile()
+        try:
+            profiler.runcall(report, args, metrics)
+        finally:
+            profiler.dump_stats(args.cprofile)
+            print(f'cProfile output written to {args.cprofile}')
+    else:
+        report(args, metrics)
+    if args.profile:
+        metrics.write(args.profile)
+        print(f'\n{metrics.summary()}')
+        print(f'Stage metrics written to {args.profile}')
+
+
+def report(args, metrics):
+    '''Ingest any new logs named in args and report on the dataset,
+    recording the progress of each stage in metrics.'''
     # Dataset filename
     dataset_name = args.dataset_name
 
@@ -60,223 +273,143 @@ def main():
         print(f'Importing existing dataset {dataset_name}.')
         pass
 
-    inf_hosts = config['infrastructure_hosts']
-    num_inf_hosts = len(inf_hosts)
+    classifier = HostClassifier.from_config(config)
 
     # TODO: Should host filtering take place here?
     #       It leaves a disconnect between the pickled data which _may_ have
     #       been culled and the actual data being referenced.
-    logproc = LogData(dataset_name, ignore_hosts=args.ignorehosts)
+    logproc = LogData(dataset_name,
+                      gethostnames=args.hostnames,
+                      ignore_hosts=args.ignorehosts,
+                      chunksize=args.chunksize,
+                      jobs=args.jobs,
+                      classifier=classifier,
+                      metrics=metrics)
     logproc.read_logs(files)
 
     print('writing (potentially updated) dataset')
     logproc.write_dataset()
 
     # Filtering and analysis begins here
-    data = logproc.data
-    print(f'num full data rows = {len(data.index)}')
-
-    # Filter out a particular time period for examination
-    # Set limits on a time period to examine
+    # Restrict examination to a particular time period if requested, reading
+    # only the portion of the dataset that falls within it.
+    window_start = None
+    window_end = None
     if args.window:
         start = args.window.split('-')[0].replace('.', '-')
         end = args.window.split('-')[1].replace('.', '-')
         window_start = pd.to_datetime(start)
         window_end = pd.to_datetime(end)
         print(f'Filtering based on window {window_start} - {window_end}.')
-        data = data[pd.to_datetime(data['date']) >= window_start]
-        data = data[pd.to_datetime(data['date']) <= window_end]
-        print(f'num windowed data rows = {len(data.index)}')
-
-    all_unique_hosts = list(set(data['ipaddress']))
-    #for host in all_unique_hosts:
-    #    try:
-    #        print(f'{host} {socket.gethostbyaddr(host)[0]}')
-    #    except:
-    #        print(f'{host} offline?')
-
-    # All packages in a dictionary by channel.
-    chans = [path.split('/')[1] for path in data['path']]
-    chans = list(set(chans))
-    chans.sort()
-    chan_pkgs = OrderedDict()
-    for chan in chans:
-        # Trailing '/' added to ensure only a single channel gets stored for each
-        # due to matching overlap depending on length of substring.
-        chan_pkgs[chan] = data[data['path'].str.contains(chan+'/')]
+
+    if args.raw:
+        if args.window:
+            data = logproc.read_window(window_start, window_end)
+            print(f'num windowed data rows = {len(data.index)}')
+        else:
+            data = logproc.data
+            print(f'num full data rows = {len(data.index)}')
+
+        # Classify each distinct host once and tag every transaction with it.
+        data = data.assign(host_class=classifier.host_class(data['ipaddress']))
+
+        # Download statistics for each channel, computed in a few grouped passes.
+        with metrics.stage('aggregate', len(data.index)) as st:
+            chan_stats = channel_stats(data, classifier)
+            st.rows_out = len(chan_stats)
+    else:
+        # Download statistics for each channel from the daily rollup tables.
+        # Approximate host counts need the small per-day sketches rather
+        # than the per-host table.
+        if args.approxhosts:
+            names = ['names', 'paths', 'sketches']
+            print(f'Unique host counts are estimates, with a relative '
+                  f'standard error of {relative_error()*100:.1f}%.')
+        else:
+            names = ['names', 'hosts', 'paths']
+        rollups = logproc.read_rollups(window_start, window_end, names)
+        with metrics.stage('aggregate', len(rollups['names'].index)
+                           if rollups['names'] is not None else 0) as st:
+            chan_stats = rollup_stats(rollups, approximate=args.approxhosts)
+            st.rows_out = len(chan_stats)
+        nrows = sum(stats['downloads'] for stats in chan_stats.values())
+        if args.window:
+            print(f'num windowed data rows = {nrows}')
+        else:
+            print(f'num full data rows = {nrows}')
+
+    ## Determine which packages are also available via PyPI
+    pypi = PyPICache(config.get('pypi_cache',
+                                os.path.join(dataset_name, 'pypi_cache.json')),
+                     index_url=config.get('pypi_index', DEFAULT_INDEX),
+                     ttl=config.get('pypi_cache_ttl', DEFAULT_TTL),
+                     offline=args.offline)
+    names = [statsum['name'] for stats in chan_stats.values()
+             for statsum in stats['names']]
+    with metrics.stage('pypi', len(names)) as st:
+        on_pypi = pypi.lookup(names)
+        st.rows_out = pypi.queries
+    print(f'PyPI index queries made: {pypi.queries}')
 
     total_downloads = 0
-    for chan in chan_pkgs.keys():
-        total_downloads += len(chan_pkgs[chan].index)
+    for chan in chan_stats.keys():
+        total_downloads += chan_stats[chan]['downloads']
     print(f'TOTAL downloads = {total_downloads}')
 
     # For each channel, generate summary report of the download activity.
-    for chan in chan_pkgs.keys():
+    specs = []
+    for chan, stats in chan_stats.items():
         print(f'\n\nSummary for channel: {chan}')
         print('-----------------------------')
 
-        pkgs = chan_pkgs[chan]
-        # Unique days
-        dates = set(pkgs['date'])
-        dates = list(dates)
-        dates.sort()
-        bydate = OrderedDict()
-
-        start_date = dates[0]
-        end_date = dates[-1]
-        time_range = end_date - start_date
-        days_elapsed = time_range.days
-        if days_elapsed == 0:
-            days_elapsed = 1
-        days_elapsed += 1
+        start_date = stats['start_date']
+        end_date = stats['end_date']
+        days_elapsed = stats['days_elapsed']
         print(f'\nOver the period {start_date.strftime("%m-%d-%Y")} '
               f'to {end_date.strftime("%m-%d-%Y")}')
         print(f'{days_elapsed} days')
 
         # Downloads per day over time frame
-        for date in dates:
-            bydate[date] = len(pkgs[pkgs['date'] == date])
+        bydate = stats['bydate']
 
-        chan_downloads = len(pkgs.index)
+        chan_downloads = stats['downloads']
         print(f'Downloads: {chan_downloads}')
 
         print(f'Average downloads per day: {ceil(chan_downloads / days_elapsed)}')
 
         # Total bandwidth consumed by this channel's use over time frame.
-        bytecount = pkgs['size'].sum()
+        bytecount = stats['bytes']
         gib = bytecount / 1e9
         print(f'Data transferred: {gib:.2f} GiB')
 
         # Number of unique hosts and geographic location
-        unique_hosts = set(pkgs['ipaddress'])
-        num_unique_hosts = len(unique_hosts)
+        num_unique_hosts = stats['unique_hosts']
         print(f'Unique hosts {num_unique_hosts}')
 
         ## Unique packages
-        unique_pkgs = set(pkgs['path'])
-        print(f'Unique full package names {len(unique_pkgs)}')
-
-        # What is the fraction of downloads for each OS?
-        num_linux_txns = len(pkgs[pkgs['path'].str.contains('linux-64')].index)
-        num_osx_txns = len(pkgs[pkgs['path'].str.contains('osx-64')].index)
-        pcnt_linux_txns = (num_linux_txns / float(chan_downloads))*100
-        pcnt_osx_txns = (num_osx_txns / float(chan_downloads))*100
+        print(f'Unique full package names {stats["unique_paths"]}')
 
         # What fraction of total downloads come from non-infrastructure on-site hosts?
-        noninf = pkgs[~pkgs['ipaddress'].isin(config['infrastructure_hosts'])]
-        total_noninf = len(noninf.index)
+        total_noninf = stats['noninf_downloads']
         print(f'Non-infrastructure downloads: {total_noninf}')
         print(f'Percentage noninf downloads: {(total_noninf/chan_downloads)*100:.1f}%')
 
         # What fraction of total downloads come from off-site hosts?
-        int_host_patterns = ['^'+s for s in config['internal_host_specs']]
-        offsite = pkgs[~pkgs['ipaddress'].str.contains(
-            '|'.join(int_host_patterns), regex=True)]
-        num_offsite_hosts = len(set(offsite['ipaddress']))
+        num_offsite_hosts = stats['offsite_hosts']
         print(f'num unique off-site hosts: {num_offsite_hosts}')
-        onsite = pkgs[pkgs['ipaddress'].str.contains(
-            '|'.join(int_host_patterns), regex=True)]
-        num_onsite_hosts = len(set(onsite['ipaddress']))
+        num_onsite_hosts = stats['onsite_hosts']
         print(f'num unique on-site hosts: {num_onsite_hosts}')
 
-        infra = pkgs[pkgs['ipaddress'].str.contains('|'.join(inf_hosts))]
-
         # Totals of unique software titles
         # i.e. name without version, hash, py or build iteration values
-        # Extract simple package titles from 'path' column of data frame.
-        names = list(pkgs['name'])
-        unique_names = list(set(names))
-        name_statsums = []
-        for name in unique_names:
-            statsum = {}
-            statsum['name'] = name
-            statsum['total'] = names.count(name)
-            # Sum on- and off-site transactions for each package name
-            # 'on-site' means transactions to non-infrastructure hosts.
-            name_txns = pkgs[pkgs['name'] == name]
-
-            on_txns = name_txns[name_txns['ipaddress'].str.contains(
-            '|'.join(int_host_patterns), regex=True)]
-            # Filter out hosts designated as infrastructure hosts in config file.
-            on_txns = on_txns[~on_txns['ipaddress'].str.contains(
-            '|'.join(inf_hosts))]
-
-            num_onsite_txns = len(on_txns.index)
-            statsum['onsite'] = num_onsite_txns
-
-            off_txns = name_txns[~name_txns['ipaddress'].str.contains(
-            '|'.join(int_host_patterns), regex=True)]
-            num_offsite_txns = len(off_txns.index)
-            statsum['offsite'] = num_offsite_txns
-
-            infra_txns = name_txns[name_txns['ipaddress'].str.contains(
-            '|'.join(inf_hosts))]
-            num_infra_txns = len(infra_txns.index)
-            statsum['infra'] = num_infra_txns
-
-            ## Determine which packages are also available via PyPI
-            url = f'https://pypi.org/pypi/{name}/json'
-            try:
-                rq = urllib.request.urlopen(url)
-                #pl = f.read().decode('utf-8')
-                #piinfo = json.loads(pl)
-                statsum['pypi'] = True
-            except(HTTPError):
-                statsum['pypi'] = False
-            #statsum['pypi'] = False
-
-            name_statsums.append(statsum)
-
-        name_statsums.sort(key=lambda x: x['total'], reverse=True)
-        x_onsite = [i['onsite'] for i in name_statsums]
-        x_infra = [i['infra'] for i in name_statsums]
-        x_offsite = [i['offsite'] for i in name_statsums]
-        y = [i['name'] for i in name_statsums]
-
-        print(f'Number of unique {chan} titles downloaded: {len(unique_names)}')
-        # For each unique softare name, sum the number of transactions from internal hosts.
-        fig, axes = plt.subplots(figsize=(10,25))
-        plt.grid(which='major', axis='x')
-        plt.title(f'{chan} -- {start_date.strftime("%Y%m%d")} - {end_date.strftime("%Y%m%d")}')
-        plt.xlabel('Downloads')
-        axes.set_ylim(-1,len(name_statsums))
-        axes.tick_params(labeltop=True)
-
-        plt.gca().invert_yaxis()
-        width = 1
-        from operator import add
-        barlists = []
-        # Horizontal stacked bar chart with off-site, on-site, and infrastructure transactions.
-        barlists.append(axes.barh(y, x_offsite, width, edgecolor='white', color='tab:blue'))
-        barlists.append(axes.barh(y, x_onsite, width, left=x_offsite, edgecolor='white', color='tab:green'))
-        # Sum bars up to this point to correctly stack the subsequent one(s).
-        offset = list(map(add, x_offsite, x_onsite))
-        barlists.append(axes.barh(y, x_infra, width, left=offset, edgecolor='white', color='tab:olive'))
-
-        for i,statsum in enumerate(name_statsums):
-            if statsum['pypi'] == True:
-                axes.get_yticklabels()[i].set_color('orange')
-                axes.get_yticklabels()[i].set_weight('bold')
-
-        # Annotate plot with additional stats
-        props = dict(boxstyle='round', facecolor='wheat', alpha=0.5)
-        plural = ''
-        if days_elapsed > 1:
-            plural = 's'
-        stats_text = (f'{days_elapsed} day{plural}\n'
-                     f'Total Downloads: {chan_downloads}\n'
-                     f'Average downloads per day: {ceil(chan_downloads / days_elapsed)}\n'
-                     f'Unique titles: {len(unique_names)}\n'
-                     f'Data transferred: {gib:.2f} GiB\n'
-                     f'Linux transactions: {pcnt_linux_txns:.1f}%\n'
-                     f'Macos transactions: {pcnt_osx_txns:.1f}%\n'
-                     f'Unique on-site hosts: {num_onsite_hosts}\n'
-                     f'Unique off-site hosts: {num_offsite_hosts}\n\n'
-                     f'   Orange titles are available on PyPI.')
-        axes.text(0.45, 0.05, stats_text, transform=axes.transAxes, fontsize=14, bbox=props)
-        axes.legend(['off-site', 'on-site', 'on-site infrastructure'])
-
-        plt.tight_layout()
-        short_startdate = start_date.strftime('%Y%m%d')
-        short_enddate = end_date.strftime('%Y%m%d')
-        plt.savefig(f'{chan}-{short_startdate}-{short_enddate}.png')
+        # along with their on-site, off-site and infrastructure downloads.
+        print(f'Number of unique {chan} titles downloaded: {len(stats["names"])}')
+        specs.append(chart_spec(chan, stats, on_pypi))
+
+    # Draw a chart for each channel whose statistics have changed.
+    renderer = ChartRenderer(jobs=args.jobs)
+    with metrics.stage('render', len(specs)) as st:
+        written = renderer.render(specs)
+        st.rows_out = len(written)
+    for path in written:
+        print(f'Wrote {path}')
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+import os
+import hashlib
+from conmets.readers import codec_of
+
+# Number of leading bytes of a file hashed to check that a file identified
+# by its inode still holds the content that was read from it before.
+HEAD_BYTES = 4096
+
+
+def head_fingerprint(fname, nbytes=HEAD_BYTES):
+    '''MD5 hash of the first nbytes of a file.'''
+    with open(fname, 'rb') as f:
+        return hashlib.md5(f.read(nbytes)).hexdigest()
+
+
+def file_entry(fname, offset=0, f=None):
+    '''Manifest entry describing the current state of a file, recording
+    that it has been read up to byte offset. If the file is open as binary
+    file object f, it is described through f, which still refers to the
+    file that was read should fname since have been replaced.'''
+    if f is None:
+        st = os.stat(fname)
+        head = head_fingerprint(fname)
+    else:
+        st = os.fstat(f.fileno())
+        head = hashlib.md5(os.pread(f.fileno(), HEAD_BYTES, 0)).hexdigest()
+    return {'inode': st.st_ino,
+            'size': st.st_size,
+            'mtime': st.st_mtime_ns,
+            'offset': offset,
+            'head': head}
+
+
+def current_inode(path):
+    '''Inode of the file at path, or None if there is none.'''
+    try:
+        return os.stat(path).st_ino
+    except(FileNotFoundError):
+        return None
+
+
+class FileManifest():
+    '''Record of how much of each log file has been ingested.
+
+    Entries are keyed on the absolute path of each file and hold its inode,
+    size and modification time when last read, the byte offset up to which
+    it was read and a hash of its first few KiB. This allows read_logs to
+    tell from a stat() call alone whether a file needs reading at all, and
+    to resume a log that has grown since it was last read rather than
+    reading it again from the start.
+
+    Files that cannot be matched this way are read in full; the MD5 hashes
+    of complete files recorded in the dataset remain the fallback test of
+    whether their content was already ingested.'''
+
+    def __init__(self, entries):
+        # entries is the dict held in the dataset manifest, updated in place.
+        self.entries = entries
+
+    def find(self, path, st):
+        '''Return the key and entry for path, falling back to an entry for
+        the same inode under another name (i.e. a log renamed by rotation).
+
+        Rotation usually creates a new log under the old name straight
+        away, so an entry is taken from another name whenever the file now
+        at that name is a different one, not only when it is missing.'''
+        entry = self.entries.get(path)
+        if entry is not None and entry['inode'] == st.st_ino:
+            return path, entry
+        for key, other in self.entries.items():
+            if (key != path and other['inode'] == st.st_ino and
+                    current_inode(key) != other['inode']):
+                return key, other
+        return path, entry
+
+    def plan(self, fname):
+        '''Decide how to read fname.
+
+        Returns a tuple of (action, offset) where action is one of
+            'skip' - the file has been read to its end and is unchanged
+            'resume' - the file has grown; read from offset onwards
+            'read' - read the whole file'''
+        path = os.path.abspath(fname)
+        st = os.stat(fname)
+        key, entry = self.find(path, st)
+        if entry is None or entry['inode'] != st.st_ino:
+            return ('read', 0)
+        if key != path:
+            self.entries[path] = self.entries.pop(key)
+        compressed = codec_of(fname) is not None
+        # A live log may have been recorded while part way through it, so
+        # it is skipped only if read to its end.
+        if (entry['size'] == st.st_size and entry['mtime'] == st.st_mtime_ns
+                and (compressed or entry['offset'] >= st.st_size)):
+            return ('skip', entry['offset'])
+        # Only uncompressed logs are appended to in place. A file smaller
+        # than the point already read has been truncated and starts afresh.
+        if (compressed or st.st_size < entry['offset'] or
+                head_fingerprint(fname, min(HEAD_BYTES, entry['size'])) !=
+                entry['head']):
+            return ('read', 0)
+        return ('resume', entry['offset'])
+
+    def record(self, fname, entry):
+        self.entries[os.path.abspath(fname)] = entry
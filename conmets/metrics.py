@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+import sys
+import json
+import time
+import resource
+from itertools import islice
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Stages of the ingest and report pipeline, in the order they run.
+#   hash - MD5 hashing of whole log files
+#   decompress - reading lines from compressed logs
+#   read - reading lines from uncompressed logs
+#   parse - prefiltering and regex parsing of log lines
+#   filter - reduction to successful package downloads
+#   dedupe - sorting and removal of duplicate transactions
+#   hostnames - reverse-DNS lookups
+#   write - writing new date partitions
+#   rollup - aggregation of new data into the rollup tables
+#   load - reading stored data or rollup tables for a report
+#   aggregate - computation of per-channel statistics
+#   pypi - PyPI availability lookups
+#   render - drawing of charts
+#   query - computation of LogData.query results not found in its cache
+STAGES = ['hash', 'decompress', 'read', 'parse', 'filter', 'dedupe',
+          'hostnames', 'write', 'rollup', 'load', 'aggregate', 'pypi',
+          'render', 'query']
+
+# Number of lines read at a time by timed_lines.
+READ_BATCH = 4096
+
+
+def peak_rss_kb(who=resource.RUSAGE_SELF):
+    '''Peak resident set size, in KiB, of this process or (with
+    resource.RUSAGE_CHILDREN) of the largest of its finished children.'''
+    rss = resource.getrusage(who).ru_maxrss
+    # Reported in bytes on macOS, KiB elsewhere.
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+class StageRecord():
+    '''Rows in and out of one run of a stage, to be filled in by the code
+    being timed.'''
+
+    def __init__(self, rows_in=None, rows_out=None):
+        self.rows_in = rows_in
+        self.rows_out = rows_out
+
+
+class Metrics():
+    '''Collects wall time, row counts and event counters for the stages of
+    a run.
+
+    Each stage accumulates its total time, the number of times it ran and
+    the rows it took in and gave out, over all of its runs. Counters record
+    anything else worth knowing, e.g. the number of unparseable lines.
+    Metrics collected in a worker process are sent back as a dict and
+    combined with merge().'''
+
+    def __init__(self):
+        self.stages = OrderedDict()
+        self.counters = OrderedDict()
+        self.started = time.perf_counter()
+
+    def add(self, name, seconds, rows_in=None, rows_out=None, calls=1):
+        stage = self.stages.setdefault(name, {'calls': 0,
+                                              'seconds': 0.0,
+                                              'rows_in': None,
+                                              'rows_out': None})
+        stage['calls'] += calls
+        stage['seconds'] += seconds
+        for key, rows in (('rows_in', rows_in), ('rows_out', rows_out)):
+            if rows is not None:
+                stage[key] = (stage[key] or 0) + int(rows)
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        '''Time the enclosed block as a run of stage name. The StageRecord
+        yielded may be used to set rows_in and rows_out.'''
+        record = StageRecord(rows_in)
+        t0 = time.perf_counter()
+        try:
+            yield record
+        finally:
+            self.add(name, time.perf_counter() - t0,
+                     record.rows_in, record.rows_out)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + int(n)
+
+    def timed_lines(self, lines, name):
+        '''Yield the items of the iterable lines, adding the time spent
+        fetching them (e.g. reading and decompressing a file) to stage
+        name. Lines are fetched in batches so that timing adds little to
+        the cost of each line.'''
+        it = iter(lines)
+        nlines = 0
+        seconds = 0.0
+        try:
+            while True:
+                t0 = time.perf_counter()
+                batch = list(islice(it, READ_BATCH))
+                seconds += time.perf_counter() - t0
+                if not batch:
+                    break
+                nlines += len(batch)
+                yield from batch
+        finally:
+            self.add(name, seconds, rows_out=nlines)
+
+    def merge(self, other):
+        '''Add the stages and counters of other, a Metrics or the dict
+        produced by its as_dict(), to these.'''
+        if isinstance(other, Metrics):
+            other = other.as_dict()
+        for name, stage in other['stages'].items():
+            self.add(name, stage['seconds'], stage['rows_in'],
+                     stage['rows_out'], stage['calls'])
+        for name, n in other['counters'].items():
+            self.count(name, n)
+
+    def as_dict(self):
+        ordered = [s for s in STAGES if s in self.stages]
+        ordered += [s for s in self.stages if s not in STAGES]
+        return {'wall_seconds': time.perf_counter() - self.started,
+                'peak_rss_kb': peak_rss_kb(),
+                'children_peak_rss_kb': peak_rss_kb(resource.RUSAGE_CHILDREN),
+                'stages': OrderedDict((s, self.stages[s]) for s in ordered),
+                'counters': self.counters}
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.as_dict(), f, indent=1)
+
+    def summary(self):
+        '''Table of the stages, for printing.'''
+        report = self.as_dict()
+        lines = [f'{"stage":12s} {"calls":>6s} {"seconds":>9s} '
+                 f'{"rows in":>10s} {"rows out":>10s}']
+        for name, stage in report['stages'].items():
+            rows_in = '' if stage['rows_in'] is None else stage['rows_in']
+            rows_out = '' if stage['rows_out'] is None else stage['rows_out']
+            lines.append(f'{name:12s} {stage["calls"]:6d} '
+                         f'{stage["seconds"]:9.3f} {rows_in:>10} '
+                         f'{rows_out:>10}')
+        lines.append(f'wall time {report["wall_seconds"]:.2f}s, peak RSS '
+                     f'{report["peak_rss_kb"]/1024:.1f} MiB (workers '
+                     f'{report["children_peak_rss_kb"]/1024:.1f} MiB)')
+        return '\n'.join(lines)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+import time
+import urllib.request
+from urllib.error import HTTPError, URLError
+from concurrent.futures import ThreadPoolExecutor
+from conmets.jsonfile import read_json, write_json
+
+DEFAULT_INDEX = 'https://pypi.org/pypi'
+# Seconds for which a cached availability result is trusted.
+DEFAULT_TTL = 7 * 24 * 3600
+# HTTP statuses meaning the index has no such package. Any other error
+# status is treated like a network failure: not cached, so retried.
+NOT_FOUND = (404, 410)
+
+
+class PyPICache():
+    '''Determines which package names are also available via PyPI.
+
+    Results are kept in a JSON file mapping each name to whether it was
+    found on the index and when it was checked. Names missing from the
+    cache, or whose entry is older than ttl seconds, are looked up
+    concurrently using at most max_workers threads. In offline mode no
+    lookups are made and any cached result is used regardless of age.
+
+    The index queried is index_url, which must serve the PyPI JSON API
+    (i.e. <index_url>/<name>/json), so a local stand-in server may be used
+    in place of pypi.org.'''
+
+    def __init__(self,
+                 cache_path,
+                 index_url=DEFAULT_INDEX,
+                 ttl=DEFAULT_TTL,
+                 offline=False,
+                 max_workers=8,
+                 timeout=10):
+        self.cache_path = cache_path
+        self.index_url = index_url.rstrip('/')
+        self.ttl = ttl
+        self.offline = offline
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.cache = read_json(self.cache_path)
+        self.queries = 0
+
+    def query(self, name):
+        '''Ask the index about a single name. Returns True or False, or None
+        if the index could not be reached or did not give a definite
+        answer (e.g. it was rate limiting or failing).'''
+        url = f'{self.index_url}/{name}/json'
+        try:
+            with urllib.request.urlopen(url, timeout=self.timeout):
+                return True
+        except(HTTPError) as err:
+            if err.code in NOT_FOUND:
+                return False
+            return None
+        except(URLError, OSError):
+            return None
+
+    def expired(self, name, now):
+        entry = self.cache.get(name)
+        return entry is None or now - entry['checked'] > self.ttl
+
+    def lookup(self, names):
+        '''Return a dict mapping each of names to True if it is available
+        via PyPI. Names whose availability cannot be determined map to
+        False.'''
+        names = list(dict.fromkeys(names))
+        now = time.time()
+        stale = [] if self.offline else [n for n in names
+                                         if self.expired(n, now)]
+        if stale:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                found = list(pool.map(self.query, stale))
+            self.queries += len(stale)
+            for name, available in zip(stale, found):
+                # Failed or inconclusive lookups are not cached so they are
+                # retried.
+                if available is not None:
+                    self.cache[name] = {'available': available,
+                                        'checked': now}
+            self.write()
+        return {name: self.cache.get(name, {}).get('available', False)
+                for name in names}
+
+    def write(self):
+        '''Atomically replace the cache file on disk.'''
+        write_json(self.cache_path, self.cache)
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+import os
+import pickle
+import hashlib
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+
+# Columns by which query results may be grouped and filtered.
+DIMENSIONS = ['date', 'channel', 'name', 'host_class']
+# Aggregates a query can compute for each group.
+#   downloads - number of downloads
+#   bytes - bytes transferred
+#   linux_txns, osx_txns - downloads of linux-64 and osx-64 packages
+#   unique_hosts - number of distinct IP addresses
+#   unique_paths - number of distinct full package paths
+MEASURES = ['downloads', 'bytes', 'linux_txns', 'osx_txns', 'unique_hosts',
+            'unique_paths']
+
+# How each measure is computed from the rows of a frame shaped like that
+# of query_frame(), and from the rollup tables. Summed measures come from
+# the names table; distinct counts need the table keyed by what they count,
+# which holds only the dimensions listed.
+raw_aggs = {
+    'downloads': ('size', 'size'),
+    'bytes': ('size', 'sum'),
+    'linux_txns': ('linux', 'sum'),
+    'osx_txns': ('osx', 'sum'),
+    'unique_hosts': ('ipaddress', 'nunique'),
+    'unique_paths': ('path', 'nunique'),
+}
+rollup_sources = {
+    'downloads': ('names', 'sum'),
+    'bytes': ('names', 'sum'),
+    'linux_txns': ('names', 'sum'),
+    'osx_txns': ('names', 'sum'),
+    'unique_hosts': ('hosts', 'nunique'),
+    'unique_paths': ('paths', 'nunique'),
+}
+rollup_dimensions = {
+    'names': ['date', 'channel', 'name', 'host_class'],
+    'hosts': ['date', 'channel', 'host_class'],
+    'paths': ['date', 'channel'],
+}
+rollup_columns = {
+    'unique_hosts': 'ipaddress',
+    'unique_paths': 'path',
+}
+
+DEFAULT_CACHE_SIZE = 128
+
+
+def query_frame(data, classifier):
+    '''Frame of the columns a query needs from transaction data.'''
+    return pd.DataFrame({
+        'date': data['timestamp'].dt.normalize(),
+        'channel': data['channel'],
+        'name': data['name'],
+        'host_class': classifier.host_class(data['ipaddress']),
+        'ipaddress': data['ipaddress'],
+        'path': data['path'],
+        'size': data['size'],
+        'linux': data['path'].str.contains('linux-64', regex=False),
+        'osx': data['path'].str.contains('osx-64', regex=False),
+        })
+
+
+def select(df, filters):
+    '''Rows of df whose values are among those listed in filters, a dict
+    mapping column names to lists of values (or None for no
+    restriction).'''
+    mask = np.ones(len(df.index), dtype=bool)
+    for col, values in filters.items():
+        if values is not None:
+            mask &= df[col].isin(values).to_numpy()
+    return df.loc[mask]
+
+
+def group_totals(df, by, aggs):
+    '''Aggregate df over the groups of columns by, or over all its rows as
+    a single group if by is empty. aggs maps each output column to a
+    (column, function) pair as for DataFrame.agg.'''
+    # Report group keys as plain values whatever categories they came with.
+    df = df.assign(**{col: df[col].astype(str) for col in by
+                      if isinstance(df[col].dtype, pd.CategoricalDtype)})
+    if by:
+        return df.groupby(by, sort=True, observed=True).agg(**aggs)
+    return pd.DataFrame({out: [df[col].agg(func)]
+                         for out, (col, func) in aggs.items()})
+
+
+def needs_raw(by, filters, measures):
+    '''True if a query cannot be answered from the rollup tables, because a
+    distinct count is wanted by, or restricted on, a dimension missing from
+    the table it is counted from (e.g. distinct hosts per package name).'''
+    used = set(by) | {col for col, values in filters.items()
+                      if values is not None}
+    for measure in measures:
+        table = rollup_sources[measure][0]
+        if not used <= set(rollup_dimensions[table]):
+            return True
+    return False
+
+
+def rollup_tables(measures):
+    '''Names of the rollup tables needed to compute measures.'''
+    return sorted({rollup_sources[m][0] for m in measures})
+
+
+def result_frame(parts, by, measures):
+    '''Join per-table aggregates into the final result.'''
+    if not parts:
+        result = pd.DataFrame(columns=measures)
+    else:
+        result = pd.concat(parts, axis=1)
+    return result.reindex(columns=measures).fillna(0).astype('int64')
+
+
+def aggregate_raw(frame, by, filters, measures):
+    '''Answer a query from a frame made by query_frame().'''
+    frame = select(frame, filters)
+    result = group_totals(frame, by, {m: raw_aggs[m] for m in measures})
+    return result_frame([result], by, measures)
+
+
+def aggregate_rollups(rollups, by, filters, measures):
+    '''Answer a query from the rollup tables, which must be restricted to
+    the query's window already.'''
+    parts = []
+    for table in ['names', 'hosts', 'paths']:
+        wanted = [m for m in measures if rollup_sources[m][0] == table]
+        if not wanted or rollups.get(table) is None:
+            continue
+        df = select(rollups[table], {col: values
+                                     for col, values in filters.items()
+                                     if col in rollup_dimensions[table]})
+        aggs = {m: (rollup_columns.get(m, m), rollup_sources[m][1])
+                for m in wanted}
+        parts.append(group_totals(df, by, aggs))
+    return result_frame(parts, by, measures)
+
+
+class QueryCache():
+    '''Least-recently-used cache of query results, optionally backed by a
+    directory of pickled results shared between processes and runs.
+
+    Keys are tuples that include the identifier and version stamp of the
+    dataset queried. The stamp changes whenever the dataset is written, so
+    entries for older data are never returned; on disk they are removed
+    when a result for a newer version of the same dataset is stored.'''
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE, cache_dir=None):
+        self.maxsize = maxsize
+        self.cache_dir = cache_dir
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key):
+        digest = hashlib.md5(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f'{key[0]}-{key[1]}-{digest}.pkl')
+
+    def get(self, key):
+        '''Cached result for key, or None.'''
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        if self.cache_dir is not None:
+            try:
+                with open(self.path(key), 'rb') as f:
+                    result = pickle.load(f)
+                self.remember(key, result)
+                self.hits += 1
+                return result
+            except(FileNotFoundError, EOFError, pickle.UnpicklingError):
+                pass
+        self.misses += 1
+        return None
+
+    def remember(self, key, result):
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def put(self, key, result):
+        self.remember(key, result)
+        if self.cache_dir is None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.path(key)
+        tmppath = f'{path}.tmp'
+        with open(tmppath, 'wb') as f:
+            pickle.dump(result, f)
+        os.replace(tmppath, path)
+        # Drop results for earlier versions of this dataset.
+        prefix = f'{key[0]}-'
+        current = f'{key[0]}-{key[1]}-'
+        for fname in os.listdir(self.cache_dir):
+            if fname.startswith(prefix) and not fname.startswith(current):
+                try:
+                    os.remove(os.path.join(self.cache_dir, fname))
+                except(FileNotFoundError):
+                    pass
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+import os
+import bz2
+import gzip
+import lzma
+import mmap
+import queue
+import threading
+from collections import OrderedDict
+try:
+    import zstandard
+except(ImportError):
+    zstandard = None
+
+# Size of the blocks in which logs are read, and the number of decompressed
+# blocks that may wait in the queue between a decompression thread and the
+# parser. Together these bound the memory used by a reader, whatever the
+# size of the file.
+BLOCK_SIZE = 1024 * 1024
+QUEUE_DEPTH = 4
+
+
+def open_zstd(path):
+    if zstandard is None:
+        raise ValueError(f'{path} is zstd compressed. Install the zstandard '
+                         'package to read it.')
+    return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'),
+                                                      closefd=True)
+
+
+# Compression formats of rotated logs, recognized by the leading "magic"
+# bytes of the file rather than its name. Each maps to a function opening a
+# file of that format as a binary stream of decompressed data.
+codecs = OrderedDict([
+    ('gzip', (b'\x1f\x8b', gzip.open)),
+    ('bz2', (b'BZh', bz2.open)),
+    ('xz', (b'\xfd7zXZ\x00', lzma.open)),
+    ('zstd', (b'\x28\xb5\x2f\xfd', open_zstd)),
+])
+
+
+def register_codec(name, magic, opener):
+    '''Add (or replace) a compression format. opener(path) must return a
+    binary file-like object with a read() method.'''
+    codecs[name] = (magic, opener)
+
+
+def codec_of(path):
+    '''Name of the compression format of the file at path, or None if it is
+    not compressed in any registered format.'''
+    with open(path, 'rb') as f:
+        head = f.read(max(len(magic) for magic, opener in codecs.values()))
+    for name, (magic, opener) in codecs.items():
+        if head.startswith(magic):
+            return name
+    return None
+
+
+def split_lines(buf):
+    '''Split bytes ending in a newline into lines, without their newlines.
+    Only b'\\n' ends a line, as when iterating over a binary file.'''
+    lines = buf.split(b'\n')
+    lines.pop()
+    return lines
+
+
+class MappedLines():
+    '''Iterate over the complete lines of an uncompressed file from byte
+    offset onwards, via a read-only memory map.
+
+    Lines are taken a block at a time so that the file is never read into
+    memory whole, and a trailing partial line (one still being written) is
+    left for the next read. nbytes counts the bytes of the lines
+    yielded.'''
+
+    compressed = False
+
+    def __init__(self, path, offset=0, block_size=BLOCK_SIZE):
+        self.path = path
+        self.offset = offset
+        self.block_size = block_size
+        self.nbytes = 0
+
+    def __iter__(self):
+        with open(self.path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size <= self.offset:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                pos = self.offset
+                while pos < size:
+                    end = mm.rfind(b'\n', pos, min(pos + self.block_size, size))
+                    if end < 0:
+                        # A line longer than a block.
+                        end = mm.find(b'\n', pos + self.block_size, size)
+                        if end < 0:
+                            break
+                    block = mm[pos:end + 1]
+                    self.nbytes += len(block)
+                    pos = end + 1
+                    yield from split_lines(block)
+
+    def close(self):
+        pass
+
+
+class ThreadedLines():
+    '''Iterate over the lines of a compressed file, decompressing it in a
+    background thread.
+
+    The thread reads fixed-size blocks of decompressed data into a bounded
+    queue, from which lines are split as they are consumed. zlib, bz2, lzma
+    and zstd all release the GIL while decompressing, so decompression of
+    the next blocks overlaps with parsing of the current one. nbytes counts
+    the decompressed bytes yielded.'''
+
+    compressed = True
+
+    def __init__(self, path, opener, block_size=BLOCK_SIZE, depth=QUEUE_DEPTH):
+        self.path = path
+        self.opener = opener
+        self.block_size = block_size
+        self.blocks = queue.Queue(maxsize=depth)
+        self.stopping = threading.Event()
+        self.thread = None
+        self.nbytes = 0
+
+    def fill(self):
+        '''Body of the decompression thread.'''
+        try:
+            with self.opener(self.path) as f:
+                while not self.stopping.is_set():
+                    block = f.read(self.block_size)
+                    self.put(block)
+                    if not block:
+                        return
+        except(Exception) as err:
+            self.put(err)
+
+    def put(self, item):
+        # Give up if the reader is closed while the queue is full.
+        while not self.stopping.is_set():
+            try:
+                self.blocks.put(item, timeout=0.1)
+                return
+            except(queue.Full):
+                continue
+
+    def __iter__(self):
+        self.thread = threading.Thread(target=self.fill, daemon=True)
+        self.thread.start()
+        carry = b''
+        try:
+            while True:
+                block = self.blocks.get()
+                if isinstance(block, Exception):
+                    raise block
+                if not block:
+                    break
+                buf = carry + block
+                end = buf.rfind(b'\n') + 1
+                carry = buf[end:]
+                if end:
+                    self.nbytes += end
+                    yield from split_lines(buf[:end])
+            if carry:
+                # A compressed log is complete; keep its unterminated last line.
+                self.nbytes += len(carry)
+                yield carry
+        finally:
+            self.close()
+
+    def close(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+def open_lines(path, offset=0):
+    '''Return an iterable over the lines of the log at path, as bytes
+    without line endings, decompressing it if necessary. An uncompressed
+    log is read from byte offset onwards, up to its last complete line.'''
+    codec = codec_of(path)
+    if codec is None:
+        return MappedLines(path, offset)
+    return ThreadedLines(path, codecs[codec][1])
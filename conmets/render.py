@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+import os
+import json
+import hashlib
+from math import ceil
+from concurrent.futures import ProcessPoolExecutor
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+# File, within the output directory, recording the fingerprint of the input
+# from which each chart there was last drawn.
+FINGERPRINT_FILE = '.conmets-charts.json'
+# Bump when the appearance of the charts changes so all are redrawn.
+CHART_VERSION = 1
+
+
+def chart_spec(chan, stats, on_pypi):
+    '''Everything needed to draw the chart for one channel, taken from its
+    entry in the output of channel_stats or rollup_stats. Holds only plain
+    values so that it can be sent to a worker process and hashed.'''
+    names = stats['names']
+    start = stats['start_date'].strftime('%Y%m%d')
+    end = stats['end_date'].strftime('%Y%m%d')
+    return {
+        'version': CHART_VERSION,
+        'filename': f'{chan}-{start}-{end}.png',
+        'title': f'{chan} -- {start} - {end}',
+        'names': [s['name'] for s in names],
+        'offsite': [s['offsite'] for s in names],
+        'onsite': [s['onsite'] for s in names],
+        'infra': [s['infra'] for s in names],
+        'pypi': [bool(on_pypi.get(s['name'], False)) for s in names],
+        'days_elapsed': int(stats['days_elapsed']),
+        'downloads': int(stats['downloads']),
+        'bytes': int(stats['bytes']),
+        'linux_txns': int(stats['linux_txns']),
+        'osx_txns': int(stats['osx_txns']),
+        'onsite_hosts': int(stats['onsite_hosts']),
+        'offsite_hosts': int(stats['offsite_hosts']),
+        }
+
+
+def fingerprint(spec):
+    encoded = json.dumps(spec, sort_keys=True).encode('utf-8')
+    return hashlib.md5(encoded).hexdigest()
+
+
+def draw_chart(spec, outdir='.'):
+    '''Draw the horizontal stacked bar chart of downloads per title for one
+    channel and save it as a PNG in outdir. Returns the path written.
+
+    Uses a Figure not registered with pyplot, so nothing outlives the call
+    and no global plotting state is shared between charts.'''
+    names = spec['names']
+    x_offsite = spec['offsite']
+    x_onsite = spec['onsite']
+    x_infra = spec['infra']
+    days_elapsed = spec['days_elapsed']
+    chan_downloads = spec['downloads']
+    gib = spec['bytes'] / 1e9
+    pcnt_linux_txns = (spec['linux_txns'] / float(chan_downloads))*100
+    pcnt_osx_txns = (spec['osx_txns'] / float(chan_downloads))*100
+
+    fig = Figure(figsize=(10, 25))
+    FigureCanvasAgg(fig)
+    axes = fig.add_subplot()
+    axes.grid(which='major', axis='x')
+    axes.set_title(spec['title'])
+    axes.set_xlabel('Downloads')
+    axes.set_ylim(-1, len(names))
+    axes.tick_params(labeltop=True)
+    axes.invert_yaxis()
+
+    width = 1
+    # Horizontal stacked bar chart with off-site, on-site, and
+    # infrastructure transactions.
+    axes.barh(names, x_offsite, width, edgecolor='white', color='tab:blue')
+    axes.barh(names, x_onsite, width, left=x_offsite, edgecolor='white',
+              color='tab:green')
+    # Sum bars up to this point to correctly stack the subsequent one.
+    offset = [off + on for off, on in zip(x_offsite, x_onsite)]
+    axes.barh(names, x_infra, width, left=offset, edgecolor='white',
+              color='tab:olive')
+
+    labels = axes.get_yticklabels()
+    for i, pypi in enumerate(spec['pypi']):
+        if pypi:
+            labels[i].set_color('orange')
+            labels[i].set_weight('bold')
+
+    # Annotate plot with additional stats
+    props = dict(boxstyle='round', facecolor='wheat', alpha=0.5)
+    plural = ''
+    if days_elapsed > 1:
+        plural = 's'
+    stats_text = (f'{days_elapsed} day{plural}\n'
+                  f'Total Downloads: {chan_downloads}\n'
+                  f'Average downloads per day: {ceil(chan_downloads / days_elapsed)}\n'
+                  f'Unique titles: {len(names)}\n'
+                  f'Data transferred: {gib:.2f} GiB\n'
+                  f'Linux transactions: {pcnt_linux_txns:.1f}%\n'
+                  f'Macos transactions: {pcnt_osx_txns:.1f}%\n'
+                  f'Unique on-site hosts: {spec["onsite_hosts"]}\n'
+                  f'Unique off-site hosts: {spec["offsite_hosts"]}\n\n'
+                  f'   Orange titles are available on PyPI.')
+    axes.text(0.45, 0.05, stats_text, transform=axes.transAxes, fontsize=14,
+              bbox=props)
+    axes.legend(['off-site', 'on-site', 'on-site infrastructure'])
+
+    fig.tight_layout()
+    path = os.path.join(outdir, spec['filename'])
+    fig.savefig(path)
+    fig.clear()
+    return path
+
+
+class ChartRenderer():
+    '''Draws the per-channel charts, in parallel and only when needed.
+
+    A fingerprint of the input of every chart written is kept in
+    FINGERPRINT_FILE in the output directory. A chart whose PNG exists and
+    whose input has the same fingerprint as when it was last drawn is
+    skipped, so re-running a report over unchanged data draws nothing.
+    Charts that do need drawing are spread over up to jobs worker
+    processes.'''
+
+    def __init__(self, outdir='.', jobs=1):
+        self.outdir = outdir
+        self.jobs = jobs
+        self.fingerprint_path = os.path.join(outdir, FINGERPRINT_FILE)
+        self.fingerprints = {}
+        try:
+            with open(self.fingerprint_path, 'r') as f:
+                self.fingerprints = json.load(f)
+        except(FileNotFoundError, json.JSONDecodeError):
+            pass
+
+    def stale(self, spec):
+        path = os.path.join(self.outdir, spec['filename'])
+        return (not os.path.exists(path) or
+                self.fingerprints.get(spec['filename']) != fingerprint(spec))
+
+    def render(self, specs):
+        '''Draw the charts described by specs that are out of date. Returns
+        the list of paths written.'''
+        todo = [spec for spec in specs if self.stale(spec)]
+        skipped = len(specs) - len(todo)
+        if skipped:
+            print(f'{skipped} chart(s) unchanged; not redrawn.')
+        if not todo:
+            return []
+        os.makedirs(self.outdir, exist_ok=True)
+        if self.jobs > 1 and len(todo) > 1:
+            with ProcessPoolExecutor(max_workers=min(self.jobs, len(todo))) as pool:
+                written = list(pool.map(draw_chart, todo,
+                                        [self.outdir] * len(todo)))
+        else:
+            written = [draw_chart(spec, self.outdir) for spec in todo]
+        for spec in todo:
+            self.fingerprints[spec['filename']] = fingerprint(spec)
+        self.write()
+        return written
+
+    def write(self):
+        '''Atomically replace the fingerprint file.'''
+        tmppath = f'{self.fingerprint_path}.tmp'
+        with open(tmppath, 'w') as f:
+            json.dump(self.fingerprints, f, indent=1, sort_keys=True)
+        os.replace(tmppath, self.fingerprint_path)
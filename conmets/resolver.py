@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+import time
+import queue
+import socket
+import threading
+from math import ceil
+from conmets.jsonfile import read_json, write_json
+
+# Seconds for which successful and failed lookups are trusted.
+DEFAULT_TTL = 30 * 24 * 3600
+DEFAULT_NEGATIVE_TTL = 24 * 3600
+
+# Hostname recorded for addresses that could not be resolved.
+UNRESOLVED = 'offline'
+
+
+def reverse_lookup(ip):
+    '''Default resolver backend: the primary hostname of ip.'''
+    return socket.gethostbyaddr(ip)[0]
+
+
+class HostnameResolver():
+    '''Reverse-DNS resolution of IP addresses with a persistent cache.
+
+    Only addresses absent from the cache, or whose entry has expired, are
+    looked up. Lookups run concurrently in at most max_workers threads and
+    any still outstanding once each has had roughly timeout seconds are
+    abandoned and treated as failures. The threads are daemon threads, so a
+    lookup that never returns does not hold up the exit of the process.
+    Failures are cached too, but for the shorter negative_ttl so they are
+    retried sooner.
+
+    backend is a callable taking an IP address string and returning its
+    hostname, raising an exception if there is none. It defaults to
+    socket.gethostbyaddr and may be replaced with a stub for testing.'''
+
+    def __init__(self,
+                 cache_path,
+                 backend=reverse_lookup,
+                 max_workers=32,
+                 timeout=5,
+                 ttl=DEFAULT_TTL,
+                 negative_ttl=DEFAULT_NEGATIVE_TTL):
+        self.cache_path = cache_path
+        self.backend = backend
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.cache = read_json(self.cache_path)
+        self.queries = 0
+
+    def query(self, ip):
+        try:
+            return self.backend(ip)
+        except Exception:
+            return None
+
+    def lookup(self, ips):
+        '''Look up ips concurrently, returning a dict of the hostnames of
+        those whose lookups finished in time (None for failures).'''
+        pending = queue.Queue()
+        for ip in ips:
+            pending.put(ip)
+        found = {}
+        expired = threading.Event()
+
+        def worker():
+            while not expired.is_set():
+                try:
+                    ip = pending.get_nowait()
+                except(queue.Empty):
+                    return
+                found[ip] = self.query(ip)
+
+        threads = [threading.Thread(target=worker, daemon=True)
+                   for _ in range(min(self.max_workers, len(ips)))]
+        for thread in threads:
+            thread.start()
+        deadline = (time.monotonic() +
+                    self.timeout * ceil(len(ips) / self.max_workers))
+        for thread in threads:
+            thread.join(max(0, deadline - time.monotonic()))
+        # Workers still busy are left to finish, or not, on their own.
+        expired.set()
+        done = dict(found)
+        if len(done) < len(ips):
+            print(f'{len(ips) - len(done)} hostname lookups timed out')
+        return done
+
+    def expired(self, ip, now):
+        entry = self.cache.get(ip)
+        if entry is None:
+            return True
+        ttl = self.ttl if entry['hostname'] else self.negative_ttl
+        return now - entry['checked'] > ttl
+
+    def resolve(self, ips):
+        '''Return a dict mapping each distinct address in ips to its
+        hostname, or to UNRESOLVED if it has none.'''
+        ips = list(dict.fromkeys(ips))
+        now = time.time()
+        stale = [ip for ip in ips if self.expired(ip, now)]
+        if stale:
+            found = self.lookup(stale)
+            self.queries += len(stale)
+            for ip in stale:
+                self.cache[ip] = {'hostname': found.get(ip),
+                                  'checked': now}
+            self.write()
+        return {ip: self.cache[ip]['hostname'] or UNRESOLVED for ip in ips}
+
+    def write(self):
+        '''Atomically replace the cache file on disk.'''
+        write_json(self.cache_path, self.cache)
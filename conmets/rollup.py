@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+import hashlib
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from conmets.aggregate import days_spanned
+from conmets.hll import HyperLogLog, sketch_groups
+
+# Pre-aggregated tables kept alongside the transaction data, and the key
+# columns each is grouped by. Every table is also keyed by date and channel.
+#   names - downloads, bytes and linux-64/osx-64 downloads per package
+#           name and host class
+#   hosts - downloads per IP address, so distinct hosts can be counted
+#   paths - downloads per full package path, so distinct packages can be
+#           counted
+#   sketches - HyperLogLog sketch of the IP addresses of each host class,
+#              from which distinct hosts can be estimated without the hosts
+#              table
+tables = {
+    'names': ['name', 'host_class'],
+    'hosts': ['ipaddress', 'host_class'],
+    'paths': ['path'],
+    'sketches': ['host_class'],
+}
+# Bump when the tables change so that stored ones are rebuilt.
+#   2: sketches table added
+#   3: parts stored per date
+ROLLUP_VERSION = 3
+
+
+def rollup_fingerprint(classifier):
+    '''Identifies rollup tables built by this version of rollup() with the
+    host classification of classifier.'''
+    encoded = f'{classifier.fingerprint()}:{ROLLUP_VERSION}'.encode('utf-8')
+    return hashlib.md5(encoded).hexdigest()
+
+
+def empty_table(table):
+    '''Rollup table with no rows.'''
+    if table == 'sketches':
+        values = ['downloads', 'registers']
+    elif table == 'names':
+        values = ['downloads', 'bytes', 'linux_txns', 'osx_txns']
+    else:
+        values = ['downloads']
+    empty = pd.DataFrame(columns=['date', 'channel'] + tables[table] + values)
+    return empty.astype({'date': 'datetime64[ns]'})
+
+
+def rollup(data, classifier):
+    '''Aggregate a frame of transaction data into the rollup tables.
+
+    Returns a dict mapping each table name to a DataFrame. Rows for the same
+    key may appear in more than one batch's tables; readers sum them.'''
+    if len(data.index) == 0:
+        return {table: empty_table(table) for table in tables}
+    host_class = classifier.host_class(data['ipaddress'])
+    frame = pd.DataFrame({
+        'date': data['timestamp'].dt.normalize(),
+        'channel': data['channel'],
+        'name': data['name'],
+        'ipaddress': data['ipaddress'],
+        'path': data['path'],
+        'host_class': host_class,
+        'size': data['size'],
+        'linux': data['path'].str.contains('linux-64', regex=False),
+        'osx': data['path'].str.contains('osx-64', regex=False),
+        })
+    out = {}
+    for table, keys in tables.items():
+        grouped = frame.groupby(['date', 'channel'] + keys,
+                                sort=True, observed=True)
+        if table == 'sketches':
+            agg = grouped.size().to_frame('downloads')
+            # Row indices of each group, in the order of agg's rows.
+            order = np.argsort(grouped.ngroup().to_numpy(), kind='stable')
+            groups = np.split(order, np.cumsum(agg['downloads'].to_numpy())[:-1])
+            agg['registers'] = sketch_groups(frame['ipaddress'].to_numpy(),
+                                             groups)
+            out[table] = agg.reset_index()
+            continue
+        if table == 'names':
+            agg = grouped.agg(downloads=('size', 'size'),
+                              bytes=('size', 'sum'),
+                              linux_txns=('linux', 'sum'),
+                              osx_txns=('osx', 'sum'))
+        else:
+            agg = grouped.agg(downloads=('size', 'size'))
+        out[table] = agg.reset_index()
+    return out
+
+
+def combine(table, df):
+    '''Sum the rows of a rollup table that share a key, e.g. after
+    concatenating its parts, merging the sketches of the sketches table.'''
+    grouped = df.groupby(['date', 'channel'] + tables[table],
+                         sort=True, observed=True)
+    if table == 'sketches':
+        out = grouped['downloads'].sum().to_frame()
+        out['registers'] = grouped['registers'].agg(
+            lambda regs: HyperLogLog.merged(regs).to_bytes())
+        return out.reset_index()
+    return grouped.sum().reset_index()
+
+
+def sketch_counts(sketches):
+    '''Estimate the distinct hosts of each channel, and of its on-site and
+    off-site hosts, by merging the sketches table. Returns three dicts keyed
+    on channel.'''
+    unique_hosts = {}
+    onsite_hosts = {}
+    offsite_hosts = {}
+    if sketches is None:
+        return unique_hosts, onsite_hosts, offsite_hosts
+    for chan, group in sketches.groupby('channel', observed=True):
+        internal = (group['host_class'] != 'offsite').to_numpy()
+        onsite = HyperLogLog.merged(group['registers'][internal])
+        offsite = HyperLogLog.merged(group['registers'][~internal])
+        onsite_hosts[chan] = onsite.count()
+        offsite_hosts[chan] = offsite.count()
+        # Host classes partition the addresses, so the union of the two
+        # sketches covers every host of the channel.
+        onsite.update(offsite)
+        unique_hosts[chan] = onsite.count()
+    return unique_hosts, onsite_hosts, offsite_hosts
+
+
+def rollup_stats(rollups, approximate=False):
+    '''Compute the same per-channel statistics as
+    aggregate.channel_stats, from rollup tables instead of transaction
+    rows.
+
+    If approximate is true, distinct host counts are estimated from the
+    sketches table, within the error given by hll.relative_error(), and the
+    hosts table is not needed.'''
+    stats = OrderedDict()
+    names = rollups['names']
+    if names is None or len(names.index) == 0:
+        return stats
+    paths = rollups['paths']
+    names = names.assign(
+        noninf=names['downloads'].where(names['host_class'] != 'infrastructure', 0))
+
+    bychan = names.groupby('channel', sort=True, observed=True)
+    totals = bychan.agg(start_date=('date', 'min'),
+                        end_date=('date', 'max'),
+                        downloads=('downloads', 'sum'),
+                        bytes=('bytes', 'sum'),
+                        linux_txns=('linux_txns', 'sum'),
+                        osx_txns=('osx_txns', 'sum'),
+                        noninf_downloads=('noninf', 'sum'))
+    if approximate:
+        unique_hosts, onsite_hosts, offsite_hosts = \
+            sketch_counts(rollups['sketches'])
+    else:
+        hosts = rollups['hosts']
+        unique_hosts = hosts.groupby(
+            'channel', observed=True)['ipaddress'].nunique()
+        internal = hosts['host_class'] != 'offsite'
+        onsite_hosts = hosts.loc[internal].groupby(
+            'channel', observed=True)['ipaddress'].nunique()
+        offsite_hosts = hosts.loc[~internal].groupby(
+            'channel', observed=True)['ipaddress'].nunique()
+    unique_paths = paths.groupby('channel', observed=True)['path'].nunique()
+    bydate = names.groupby(['channel', 'date'], sort=True,
+                           observed=True)['downloads'].sum()
+    byname = names.pivot_table(index=['channel', 'name'],
+                               columns='host_class',
+                               values='downloads',
+                               aggfunc='sum',
+                               fill_value=0,
+                               observed=True)
+    for host_class in ['offsite', 'onsite', 'infrastructure']:
+        if host_class not in byname.columns:
+            byname[host_class] = 0
+    byname['total'] = (byname['offsite'] + byname['onsite'] +
+                       byname['infrastructure'])
+
+    # Categorical groups come out in category order; report alphabetically.
+    totals = totals.sort_index(key=lambda idx: idx.astype(str))
+    for chan, row in totals.iterrows():
+        chanstats = {key: row[key] for key in totals.columns}
+        for key in ['downloads', 'bytes', 'linux_txns', 'osx_txns',
+                    'noninf_downloads']:
+            chanstats[key] = int(chanstats[key])
+        chanstats['days_elapsed'] = days_spanned(row['start_date'],
+                                                 row['end_date'])
+        chanstats['unique_hosts'] = int(unique_hosts.get(chan, 0))
+        chanstats['unique_paths'] = int(unique_paths.get(chan, 0))
+        chanstats['onsite_hosts'] = int(onsite_hosts.get(chan, 0))
+        chanstats['offsite_hosts'] = int(offsite_hosts.get(chan, 0))
+        chanstats['bydate'] = bydate.loc[chan]
+        chanstats['names'] = [{'name': name,
+                               'total': int(r['total']),
+                               'onsite': int(r['onsite']),
+                               'offsite': int(r['offsite']),
+                               'infra': int(r['infrastructure'])}
+                              for name, r in byname.loc[chan].iterrows()]
+        # Most downloaded first, ties in alphabetical order.
+        chanstats['names'].sort(key=lambda x: (-x['total'], x['name']))
+        stats[chan] = chanstats
+    return stats
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+import os
+import numpy as np
+import pandas as pd
+
+# Columns identifying a transaction. The remaining columns are derived from
+# these (channel, name) or filled in later (hostname).
+key_columns = ['ipaddress', 'timestamp', 'path', 'status', 'size']
+
+
+def row_fingerprints(df):
+    '''Array of 64-bit hashes of the key columns of each row of df. The
+    hashes depend only on the values, not on the categories of categorical
+    columns, so they can be compared between frames.'''
+    return pd.util.hash_pandas_object(df[key_columns],
+                                      index=False).to_numpy(dtype=np.uint64)
+
+
+class RowIndex():
+    '''Persistent set of the fingerprints of every row in a dataset, used
+    to drop transactions that are already present, such as those repeated
+    by overlapping rotated logs.
+
+    Fingerprints are kept as a sorted array per date in
+    <dataset>/index/YYYY-MM-DD.npy. A duplicate always has the same date
+    as its original, so checking a batch of new rows only loads the
+    indexes of the dates in the batch, however much older data the dataset
+    holds. With 64-bit fingerprints the chance of two distinct transactions
+    of one day colliding is negligible (about 1e-8 for 500 million rows).
+
+    Another process may add to the same dataset: indexes it has written
+    since they were loaded are reloaded, and merged with when writing, so
+    neither process loses the other's fingerprints.'''
+
+    def __init__(self, root):
+        self.root = os.path.join(root, 'index')
+        # Fingerprint arrays loaded so far, and dates changed but not yet
+        # written.
+        self.loaded = {}
+        self.dirty = set()
+        # (mtime, size) of each index file when it was loaded.
+        self.stamps = {}
+
+    def path(self, date):
+        return os.path.join(self.root, f'{date}.npy')
+
+    def stamp(self, date):
+        try:
+            st = os.stat(self.path(date))
+        except(FileNotFoundError):
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def load(self, date):
+        '''Fingerprints for date as last written, by any process.'''
+        stamp = self.stamp(date)
+        try:
+            fps = np.load(self.path(date))
+        except(FileNotFoundError):
+            fps = np.array([], dtype=np.uint64)
+        self.stamps[date] = stamp
+        return fps
+
+    def get(self, date):
+        if date not in self.loaded:
+            self.loaded[date] = self.load(date)
+        elif (date not in self.dirty and
+                self.stamp(date) != self.stamps.get(date)):
+            self.loaded[date] = self.load(date)
+        return self.loaded[date]
+
+    def add(self, date, fps):
+        self.loaded[date] = np.union1d(self.get(date), fps)
+        self.dirty.add(date)
+
+    def filter(self, df):
+        '''Return the rows of df not already in the index, keeping only the
+        first of any repeated within df, and add them to the index.'''
+        if len(df.index) == 0:
+            return df
+        fps = row_fingerprints(df)
+        days = pd.Series(df['timestamp'].dt.normalize().to_numpy())
+        keep = np.zeros(len(fps), dtype=bool)
+        for day, rows in days.groupby(days, sort=True).indices.items():
+            date = pd.Timestamp(day).strftime('%Y-%m-%d')
+            known = self.get(date)
+            dayfps = fps[rows]
+            if len(known):
+                pos = np.searchsorted(known, dayfps).clip(max=len(known) - 1)
+                seen = known[pos] == dayfps
+            else:
+                seen = np.zeros(len(rows), dtype=bool)
+            new = ~seen & ~pd.Series(dayfps).duplicated().to_numpy()
+            keep[rows[new]] = True
+            self.add(date, dayfps[new])
+        return df.loc[keep]
+
+    def rebuild(self, store):
+        '''Index every date partition of a DatasetStore from scratch.'''
+        self.loaded = {}
+        self.dirty = set()
+        self.stamps = {}
+        for date in store.partitions():
+            self.loaded = {date: np.unique(row_fingerprints(
+                store.read_partition(date)))}
+            self.dirty = {date}
+            self.write()
+
+    def write(self):
+        '''Write the indexes of dates changed since the last write, each
+        atomically, and forget all but those. Must be called with the
+        dataset locked (see DatasetStore.locked).'''
+        os.makedirs(self.root, exist_ok=True)
+        for date in self.dirty:
+            if self.stamp(date) != self.stamps.get(date):
+                # Written by another process since it was loaded.
+                self.loaded[date] = np.union1d(self.load(date),
+                                               self.loaded[date])
+            tmppath = f'{self.path(date)}.tmp.npy'
+            np.save(tmppath, self.loaded[date])
+            os.replace(tmppath, self.path(date))
+            self.stamps[date] = self.stamp(date)
+        # Keep only the most recently changed dates in memory; these are
+        # the ones a live log will add to next.
+        self.loaded = {date: self.loaded[date] for date in self.dirty}
+        self.dirty = set()
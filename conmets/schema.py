@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+import numpy as np
+import pandas as pd
+
+# Column types of the LogData frame.
+#   ipaddress - IPv4 address packed into an unsigned 32-bit integer
+#   hostname - reverse-DNS name of ipaddress, if resolved, else ''
+#   timestamp - time of the transaction
+#   channel - conda channel, i.e. first component of path
+#   path - full path of the package downloaded
+#   status - HTTP status code
+#   size - bytes transferred
+#   name - package title, without version, build or extension
+columns = {
+    'ipaddress': 'uint32',
+    'hostname': 'category',
+    'timestamp': 'datetime64[ns]',
+    'channel': 'category',
+    'path': 'category',
+    'status': 'int16',
+    'size': 'int64',
+    'name': 'category',
+}
+
+# Columns of the frame layout used before this schema was introduced.
+legacy_columns = ['ipaddress', 'hostname', 'date', 'time', 'path', 'status',
+                  'size', 'name']
+
+category_columns = [col for col, dtype in columns.items()
+                    if dtype == 'category']
+
+
+def empty_frame():
+    return pd.DataFrame({col: pd.Series(dtype=dtype)
+                         for col, dtype in columns.items()})
+
+
+def ip_to_uint32(ips):
+    '''Pack an array of dotted-quad IPv4 address strings into uint32 values.
+    Each distinct address is converted once; invalid addresses become 0.'''
+    codes, uniques = pd.factorize(np.asarray(ips, dtype=object))
+    packed = np.zeros(len(uniques), dtype='uint32')
+    for i, ip in enumerate(uniques):
+        try:
+            a, b, c, d = (int(o) for o in ip.split('.'))
+            if max(a, b, c, d) < 256:
+                packed[i] = (a << 24) | (b << 16) | (c << 8) | d
+        except(ValueError, AttributeError):
+            pass
+    return packed[codes]
+
+
+def uint32_to_ip(values):
+    '''Array of dotted-quad strings for an array of packed addresses.'''
+    values = np.asarray(values, dtype='uint32')
+    octets = [((values >> shift) & 255).astype(str) for shift in (24, 16, 8, 0)]
+    return np.array(['.'.join(o) for o in zip(*octets)], dtype=object)
+
+
+def categorize(values, transform=None):
+    '''Build a Categorical from values, optionally passing the distinct
+    values through transform (a function of a pandas Index returning an
+    Index of the same length) first. Values that transform maps together are
+    merged into one category.'''
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    uniques = pd.Index(uniques, dtype=object)
+    if transform is not None:
+        remap, uniques = pd.factorize(transform(uniques))
+        codes = remap[codes]
+    return pd.Categorical.from_codes(codes, uniques)
+
+
+def channel_categories(path):
+    '''Categorical of the channel (first path component) of each entry of
+    the categorical Series path, computed once per distinct path.'''
+    path = pd.Categorical(path)
+    chans = pd.Index(path.categories, dtype=object).str.split('/', n=2).str[1]
+    remap, uniques = pd.factorize(chans.fillna(''))
+    codes = np.where(path.codes >= 0, remap[path.codes], -1)
+    return pd.Categorical.from_codes(codes, uniques)
+
+
+def normalize_channels(paths):
+    # Normalize any 'conda-dev' channel names to 'astroconda-dev'
+    return paths.str.replace('/conda-dev', '/astroconda-dev', regex=False)
+
+
+def from_raw(buffers):
+    '''Build a frame of this schema from per-column lists of the strings
+    matched in each log line: ipaddress, timestamp (as
+    DD/Mon/YYYY:HH:MM:SS), path, status, size (already int) and name.'''
+    path = categorize(buffers['path'], normalize_channels)
+    df = pd.DataFrame({
+        'ipaddress': ip_to_uint32(buffers['ipaddress']),
+        'hostname': pd.Categorical.from_codes(
+            np.zeros(len(buffers['path']), dtype='int8'), ['']),
+        'timestamp': pd.to_datetime(buffers['timestamp'],
+                                    format='%d/%b/%Y:%H:%M:%S').astype(
+                                        'datetime64[ns]'),
+        'channel': channel_categories(path),
+        'path': path,
+        'status': np.array(buffers['status'], dtype='int16'),
+        'size': np.array(buffers['size'], dtype='int64'),
+        'name': categorize(buffers['name']),
+        })
+    return df
+
+
+def to_compact(df):
+    '''Convert a frame in the legacy layout, with string addresses and
+    status codes and separate date and time columns, to this schema.'''
+    if 'timestamp' in df.columns:
+        return conform(df)
+    path = categorize(df['path'].fillna('').astype(str), normalize_channels)
+    timestamp = (pd.to_datetime(df['date']) +
+                 pd.to_timedelta(df['time'].fillna('00:00:00').astype(str)))
+    out = pd.DataFrame({
+        'ipaddress': ip_to_uint32(df['ipaddress'].fillna('').astype(str)),
+        'hostname': categorize(df['hostname'].fillna('').astype(str)),
+        'timestamp': timestamp.astype('datetime64[ns]').to_numpy(),
+        'channel': channel_categories(path),
+        'path': path,
+        'status': pd.to_numeric(df['status'], errors='coerce').fillna(
+            0).astype('int16').to_numpy(),
+        'size': pd.to_numeric(df['size'], errors='coerce').fillna(
+            0).astype('int64').to_numpy(),
+        'name': categorize(df['name'].fillna('').astype(str)),
+        })
+    return out
+
+
+def conform(df):
+    '''Cast the columns of a frame already in this schema to its types.'''
+    return df.astype(columns)[list(columns)]
+
+
+def concat_frames(frames):
+    '''Concatenate frames of this schema, keeping categorical columns
+    categorical by first giving each frame the union of their categories.
+    Empty frames are skipped; an empty frame is returned if nothing is
+    left.'''
+    frames = [f for f in frames if len(f.index) != 0]
+    if not frames:
+        return empty_frame()
+    if len(frames) == 1:
+        return frames[0].reset_index(drop=True)
+    unified = []
+    cats = {col: pd.api.types.union_categoricals(
+                [pd.Categorical(f[col]) for f in frames]).categories
+            for col in category_columns}
+    for f in frames:
+        f = f.copy(deep=False)
+        for col in category_columns:
+            f[col] = pd.Categorical(f[col]).set_categories(cats[col])
+        unified.append(f)
+    return pd.concat(unified, ignore_index=True)
@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+import os
+import copy
+import json
+import uuid
+import fcntl
+import pickle
+import pandas as pd
+from contextlib import contextmanager
+from conmets import schema
+
+# Number of part files a date partition, or a date of a rollup table, may
+# gather before compact() rewrites them as one.
+COMPACT_PARTS = 32
+# Manifest sections that a LogData changes between writes: the hashes of
+# logs ingested, the FileManifest entries and the record of merged
+# datasets. The others are changed only while the dataset is locked.
+shared_sections = ['file_hashes', 'files', 'merged']
+
+
+def part_name():
+    '''Unique name for a new part file.'''
+    return f'part-{uuid.uuid4().hex}.parquet'
+
+
+class DatasetStore():
+    '''On-disk dataset of digested log data, partitioned by date.
+
+    The dataset is a directory laid out as
+
+        <root>/manifest.json
+        <root>/date=YYYY-MM-DD/part-<uuid>.parquet
+        <root>/rollups/<table>/date=YYYY-MM-DD/part-<uuid>.parquet
+
+    Each call to append() writes one new Parquet part file for every date
+    present in the appended rows; existing parts are never rewritten. The
+    manifest records the part files belonging to each date partition along
+    with the MD5 hashes of every log file that has been ingested and the
+    FileManifest entries describing how far each log has been read. Part files
+    not listed in the manifest (i.e. left behind by an interrupted write)
+    are ignored when reading.
+
+    Several processes, e.g. `conmets follow` and a batch run, may add to a
+    dataset at once. Each appends and writes the manifest only within
+    locked(), which brings the manifest up to date with any written by the
+    others first.
+
+    Frequent small appends, as made by `conmets follow`, are kept from
+    piling up part files by compact(), which rewrites the parts of any
+    date that has gathered too many as a single part.'''
+
+    manifest_name = 'manifest.json'
+    # 1: separate date and time columns, string addresses and status codes
+    # 2: compact column types of conmets.schema
+    format_version = 2
+
+    def __init__(self, root):
+        self.root = root
+        self.manifest = {'format': self.format_version,
+                         'partitions': {},
+                         'file_hashes': [],
+                         'files': {},
+                         'rollups': {'fingerprint': None, 'parts': {}}}
+        self.loaded_stamp = None
+        # (table, date) pairs appended to since the manifest was last
+        # written, table being None for the transaction data, and part
+        # files to remove once the manifest no longer names them.
+        self.touched = set()
+        self.obsolete = []
+        # The manifest as last read or written, against which changes made
+        # since are found.
+        self.base = copy.deepcopy(self.manifest)
+        if os.path.exists(self.manifest_path):
+            self.read_manifest()
+
+    def manifest_stamp(self):
+        '''Identifies the manifest file currently on disk, which is replaced
+        whole each time it is written, or None if there is none.'''
+        try:
+            st = os.stat(self.manifest_path)
+        except(FileNotFoundError):
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def read_manifest(self):
+        self.loaded_stamp = self.manifest_stamp()
+        with open(self.manifest_path, 'r') as f:
+            self.manifest = json.load(f)
+        self.base = copy.deepcopy(self.manifest)
+
+    def modified(self):
+        '''True if the shared sections of the manifest have been changed
+        since it was last read or written.'''
+        return any(self.manifest.get(section) != self.base.get(section)
+                   for section in shared_sections)
+
+    def rebase(self):
+        '''Bring the manifest up to date with one written by another process
+        since it was last read or written, keeping the changes made here to
+        its shared sections. The shared sections are updated in place, so
+        references held to them (e.g. LogData.hashes) remain valid.'''
+        stamp = self.manifest_stamp()
+        if stamp is None or stamp == self.loaded_stamp:
+            return
+        with open(self.manifest_path, 'r') as f:
+            fresh = json.load(f)
+        hashes = self.manifest['file_hashes']
+        old = set(self.base['file_hashes'])
+        theirs = set(fresh['file_hashes'])
+        hashes[:] = fresh['file_hashes'] + [h for h in hashes
+                                           if h not in old and h not in theirs]
+        for section in ['files', 'merged']:
+            ours = self.manifest.setdefault(section, {})
+            old = self.base.get(section, {})
+            changed = {key: value for key, value in ours.items()
+                       if old.get(key) != value}
+            removed = [key for key in old if key not in ours]
+            ours.clear()
+            ours.update(fresh.get(section, {}))
+            for key in removed:
+                ours.pop(key, None)
+            ours.update(changed)
+        for key, value in fresh.items():
+            if key not in shared_sections:
+                self.manifest[key] = value
+        self.base = copy.deepcopy(fresh)
+        self.loaded_stamp = stamp
+
+    @contextmanager
+    def locked(self):
+        '''Hold an exclusive lock on the dataset for the enclosed block,
+        which may append to it and write the manifest. The manifest is
+        rebased on entry.'''
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, '.lock'), 'a') as lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            try:
+                self.rebase()
+                yield
+            finally:
+                fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+    def refresh(self):
+        '''Re-read the manifest if it has been replaced since it was last
+        read or written, e.g. by another process adding to the dataset.
+        Returns True if it was.'''
+        stamp = self.manifest_stamp()
+        if stamp is None or stamp == self.loaded_stamp:
+            return False
+        self.read_manifest()
+        return True
+
+    def version(self):
+        '''Stamp of the state of the dataset, changed by every write.'''
+        return (self.manifest.get('id'), self.manifest.get('version'))
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.root, self.manifest_name)
+
+    @staticmethod
+    def is_legacy(path):
+        '''True if path is a single-file (pickled) dataset.'''
+        return os.path.isfile(path)
+
+    def exists(self):
+        return os.path.exists(self.manifest_path)
+
+    def partitions(self):
+        '''Sorted list of the dates, as YYYY-MM-DD strings, held in the
+        dataset.'''
+        return sorted(self.manifest['partitions'].keys())
+
+    def partition_path(self, date):
+        return os.path.join(self.root, f'date={date}')
+
+    def read_partition(self, date, parts=None):
+        '''Return a DataFrame holding all rows for a single date, or only
+        those in the named part files of its partition.'''
+        if parts is None:
+            parts = self.manifest['partitions'][date]
+        frames = [pd.read_parquet(os.path.join(self.partition_path(date), part))
+                  for part in parts]
+        if self.manifest['format'] < 2:
+            frames = [schema.to_compact(f) for f in frames]
+        return schema.concat_frames(frames)
+
+    def read(self, dates=None):
+        '''Return a DataFrame holding the rows of the requested date
+        partitions, or of all partitions if dates is None. Returns None if
+        there is no data to read.'''
+        if dates is None:
+            dates = self.partitions()
+        frames = [self.read_partition(date) for date in dates]
+        if not frames:
+            return None
+        return schema.concat_frames(frames)
+
+    def append(self, df):
+        '''Write the rows of df as new part files, one per date present.
+        The manifest is not written until write_manifest() is called.'''
+        if len(df.index) == 0:
+            return
+        df = schema.to_compact(df)
+        keys = df['timestamp'].dt.strftime('%Y-%m-%d')
+        for date, part in df.groupby(keys, sort=True):
+            self.write_part(date, part)
+
+    def write_part(self, date, df):
+        ppath = self.partition_path(date)
+        os.makedirs(ppath, exist_ok=True)
+        partname = part_name()
+        df.to_parquet(os.path.join(ppath, partname), index=False)
+        self.manifest['partitions'].setdefault(date, []).append(partname)
+        self.touched.add((None, date))
+
+    def rollup_path(self, table, date=None):
+        if date is None:
+            return os.path.join(self.root, 'rollups', table)
+        return os.path.join(self.root, 'rollups', table, f'date={date}')
+
+    def rollups_fingerprint(self):
+        return self.manifest.setdefault(
+            'rollups', {'fingerprint': None, 'parts': {}})['fingerprint']
+
+    def append_rollups(self, rollups):
+        '''Write a dict of rollup tables as new part files, one per table
+        and date present.'''
+        parts = self.manifest['rollups']['parts']
+        for table, df in rollups.items():
+            keys = df['date'].dt.strftime('%Y-%m-%d')
+            for date, part in df.groupby(keys, sort=True):
+                tpath = self.rollup_path(table, date)
+                os.makedirs(tpath, exist_ok=True)
+                partname = part_name()
+                part.to_parquet(os.path.join(tpath, partname), index=False)
+                parts.setdefault(table, {}).setdefault(date, []).append(partname)
+                self.touched.add((table, date))
+
+    def read_rollups(self, tables, start=None, end=None):
+        '''Return a dict mapping each of the named rollup tables to a
+        DataFrame of its rows dated from start to end inclusive, or None if
+        the table has no rows. Only the parts of dates in the window are
+        read.'''
+        first = pd.Timestamp(start).strftime('%Y-%m-%d') if start is not None else ''
+        last = pd.Timestamp(end).strftime('%Y-%m-%d') if end is not None else '~'
+        out = {}
+        for table in tables:
+            dates = self.manifest['rollups']['parts'].get(table, {})
+            frames = [pd.read_parquet(os.path.join(self.rollup_path(table, date),
+                                                   part))
+                      for date in sorted(dates) if first <= date <= last
+                      for part in dates[date]]
+            out[table] = pd.concat(frames, ignore_index=True) if frames else None
+        return out
+
+    def compact(self, combine=None, max_parts=COMPACT_PARTS):
+        '''Rewrite the parts of each date appended to since the manifest was
+        last written as a single part, if there are more than max_parts of
+        them. combine(table, df), if given, reduces the concatenated parts
+        of a rollup table. The replaced files are removed by the next
+        write_manifest().'''
+        for table, date in sorted(self.touched, key=lambda k: (k[0] or '', k[1])):
+            if table is None:
+                parts = self.manifest['partitions'][date]
+                path = self.partition_path(date)
+            else:
+                parts = self.manifest['rollups']['parts'][table][date]
+                path = self.rollup_path(table, date)
+            if len(parts) <= max_parts:
+                continue
+            if table is None:
+                df = self.read_partition(date)
+            else:
+                df = pd.concat([pd.read_parquet(os.path.join(path, part))
+                                for part in parts], ignore_index=True)
+                if combine is not None:
+                    df = combine(table, df)
+            partname = part_name()
+            df.to_parquet(os.path.join(path, partname), index=False)
+            self.obsolete += [os.path.join(path, part) for part in parts]
+            parts[:] = [partname]
+
+    def reset_rollups(self, fingerprint):
+        '''Forget all rollup parts, removing their files, ahead of
+        rebuilding them with the given classification fingerprint.'''
+        rollups = self.manifest.setdefault('rollups', {'parts': {}})
+        for table, dates in rollups['parts'].items():
+            if isinstance(dates, list):
+                # Undated parts of rollup tables from before version 3.
+                dates = {None: dates}
+            for date, parts in dates.items():
+                for part in parts:
+                    try:
+                        os.remove(os.path.join(self.rollup_path(table, date),
+                                               part))
+                    except(FileNotFoundError):
+                        pass
+        rollups['parts'] = {}
+        rollups['fingerprint'] = fingerprint
+        self.touched = {key for key in self.touched if key[0] is None}
+
+    def upgrade(self):
+        '''Rewrite the partitions of a dataset written in an older format,
+        one at a time, in the current format. Rollup tables are discarded so
+        that they are rebuilt in the current format too.'''
+        if self.manifest['format'] >= self.format_version:
+            return
+        with self.locked():
+            if self.manifest['format'] < self.format_version:
+                self.upgrade_locked()
+
+    def upgrade_locked(self):
+        print(f'Upgrading dataset {self.root} to format {self.format_version}...')
+        old_parts = {date: parts
+                     for date, parts in self.manifest['partitions'].items()}
+        new_parts = {}
+        for date in sorted(old_parts):
+            df = self.read_partition(date)
+            ppath = self.partition_path(date)
+            partname = part_name()
+            df.to_parquet(os.path.join(ppath, partname), index=False)
+            new_parts[date] = [partname]
+        self.reset_rollups(None)
+        self.manifest['partitions'] = new_parts
+        self.manifest['format'] = self.format_version
+        self.write_manifest()
+        # Old parts are only removed once the manifest no longer names them.
+        for date, parts in old_parts.items():
+            for part in parts:
+                os.remove(os.path.join(self.partition_path(date), part))
+
+    def write_manifest(self):
+        '''Atomically replace the manifest on disk.'''
+        # A random identifier, kept for the life of the dataset, by which
+        # datasets it is merged into recognize it.
+        self.manifest.setdefault('id', uuid.uuid4().hex)
+        # Changed by every write, so that results computed from the dataset
+        # can be recognized as out of date. Random rather than a count so
+        # that no two states of the dataset share one, even if written by
+        # different processes.
+        self.manifest['version'] = uuid.uuid4().hex
+        os.makedirs(self.root, exist_ok=True)
+        tmppath = f'{self.manifest_path}.tmp'
+        with open(tmppath, 'w') as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(tmppath, self.manifest_path)
+        self.loaded_stamp = self.manifest_stamp()
+        self.base = copy.deepcopy(self.manifest)
+        self.touched = set()
+        for path in self.obsolete:
+            try:
+                os.remove(path)
+            except(FileNotFoundError):
+                pass
+        self.obsolete = []
+
+
+def migrate(frame, hashes, dest):
+    '''Write a legacy in-memory dataset into a new partitioned dataset at
+    dest, one date partition at a time.
+
+    Parameters
+    ----------
+    frame : pandas.DataFrame
+        Digested log data.
+    hashes : list
+        MD5 hashes of the log files already ingested into frame.
+    dest : string
+        Directory of the dataset to create.'''
+    store = DatasetStore(dest)
+    if store.exists():
+        raise FileExistsError(f'Dataset {dest} already exists.')
+    keys = pd.to_datetime(frame['date']).dt.strftime('%Y-%m-%d')
+    for date, part in frame.groupby(keys, sort=True):
+        print(f'Writing partition {date}...')
+        store.write_part(date, schema.to_compact(part))
+    store.manifest['file_hashes'] = [h.strip() for h in hashes]
+    store.write_manifest()
+    return store
+
+
+def migrate_pickle(source, dest):
+    '''Convert a pickled dataset dict, as written by earlier versions of
+    LogData.write_dataset, into a partitioned dataset.'''
+    with open(source, 'rb') as f:
+        dataset = pickle.load(f)
+    return migrate(dataset['dataframe'], dataset['file_hashes'], dest)
+
+
+def migrate_split(datfile, hashfile, dest):
+    '''Convert the oldest dataset format, a pickled DataFrame with the
+    ingested file hashes held one per line in a separate file, into a
+    partitioned dataset.'''
+    frame = pd.read_pickle(datfile)
+    with open(hashfile, 'r') as f:
+        hashes = f.readlines()
+    return migrate(frame, hashes, dest)
@@ -1,24 +1,28 @@
 #!/usr/bin/env python3
-# Used to merge old-format pickled dataset and separate log file hashes
-# into the newer joined format.
+# Used to convert older single-file datasets into the date-partitioned
+# dataset directory format.
+#
+# Either a pickled dataset dict as written by earlier versions of conmets:
+#     convertdata.py data.p dataset
+# or the oldest format, a pickled dataframe and separate log file hashes:
+#     convertdata.py --hashes parsed_files.dat dataframe.dat dataset
 
-import pickle
-import pandas as pd
+import argparse
+from conmets.store import migrate_pickle, migrate_split
 
-datfile = 'dataframe.dat'
-hashfile = 'parsed_files.dat'
+ap = argparse.ArgumentParser(
+        description='Convert a single-file conmets dataset into a '
+        'partitioned dataset directory.')
+ap.add_argument('source', type=str,
+                help='Pickled dataset (or dataframe, if --hashes is given).')
+ap.add_argument('dest', type=str,
+                help='Name of dataset directory to create.')
+ap.add_argument('--hashes', type=str,
+                help='File listing hashes of parsed log files, one per line.')
+args = ap.parse_args()
 
-# Read dataframe
-frame = pd.read_pickle(datfile)
-
-# Read MD5 list
-with open(hashfile, 'r') as f:
-    hashes = f.readlines()
-
-# Store both in a dict and pickle that dict.
-data = {'file_hashes': hashes,
-        'dataframe': frame}
-
-print(data)
-print('Pickling dict...')
-pickle.dump(data, open('data.p', 'wb'))
+if args.hashes:
+    store = migrate_split(args.source, args.hashes, args.dest)
+else:
+    store = migrate_pickle(args.source, args.dest)
+print(f'Wrote {len(store.partitions())} partitions to {args.dest}')
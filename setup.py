@@ -16,11 +16,15 @@ setup(
         'numpy',
         'matplotlib',
         'pandas',
+        'pyarrow',
         'PyYAML',
     ],
     extras_require={
         'test': [
             'pytest',
         ],
+        'zstd': [
+            'zstandard',
+        ],
     }
 )
@@ -0,0 +1,39 @@
+import yaml
+import pytest
+from conmets.hosts import HostClassifier
+
+
+def log_line(i, day=1, status=200):
+    '''A package download by one of a few hosts, unique for each i.'''
+    secs = i % 86400
+    return (f'10.1.{i // 250 % 250}.{i % 250} - - '
+            f'[{day:02d}/Oct/2019:{secs // 3600:02d}:{secs // 60 % 60:02d}:'
+            f'{secs % 60:02d} +0000] '
+            f'"GET /astroconda/linux-64/pkg{i % 7}-1.0-py37_0.tar.bz2 '
+            f'HTTP/1.1" {status} {1000 + i} "-" "conda/4.7"\n')
+
+
+@pytest.fixture
+def write_log():
+    '''Write (or, with mode='a', append) log lines for the indices given.'''
+    def write(path, indices, mode='w', day=1):
+        with open(path, mode) as f:
+            f.writelines(log_line(i, day) for i in indices)
+        return str(path)
+    return write
+
+
+@pytest.fixture
+def config(tmp_path):
+    path = tmp_path / 'config.yml'
+    path.write_text("infrastructure_hosts:\n"
+                    "    - '10.1.0.1'\n"
+                    "internal_host_specs:\n"
+                    "    - '^10.1.0.'\n")
+    return str(path)
+
+
+@pytest.fixture
+def classifier(config):
+    with open(config) as f:
+        return HostClassifier.from_config(yaml.safe_load(f))
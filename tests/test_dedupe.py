@@ -0,0 +1,39 @@
+import gzip
+import os
+import shutil
+from conmets.conmets import LogData
+from conmets.main import digest, merge
+
+
+def test_log_of_duplicates(tmp_path, write_log, classifier):
+    '''A rotated log compressed under a new name has a new inode and MD5
+    hash, but every row in it has been stored already.'''
+    log = write_log(tmp_path / 'access.log', range(200))
+    dataset = str(tmp_path / 'dataset')
+    logdata = LogData(dataset, classifier=classifier)
+    logdata.read_logs([log])
+    logdata.write_dataset()
+
+    with open(log, 'rb') as f, gzip.open(f'{log}.2.gz', 'wb') as out:
+        shutil.copyfileobj(f, out)
+    os.remove(log)
+    for _ in range(2):
+        logdata = LogData(dataset, classifier=classifier)
+        logdata.read_logs([f'{log}.2.gz'])
+        assert logdata.newdata == []
+        logdata.write_dataset()
+        assert logdata.metrics.counters.get('duplicate_rows', 0) in (0, 200)
+
+    logdata = LogData(dataset, classifier=classifier)
+    assert len(logdata.data.index) == 200
+    assert logdata.read_rollups()['names']['downloads'].sum() == 200
+
+
+def test_merge_partial_of_duplicates(tmp_path, write_log, config):
+    log = write_log(tmp_path / 'access.log', range(200))
+    dataset = str(tmp_path / 'dataset')
+    partials = [str(tmp_path / 'partial1'), str(tmp_path / 'partial2')]
+    for partial in partials:
+        digest([partial, log])
+    merge([dataset] + partials + ['--config', config])
+    assert len(LogData(dataset).data.index) == 200
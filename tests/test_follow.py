@@ -0,0 +1,26 @@
+from conmets.conmets import LogData
+from conmets.follow import LogFollower
+from conmets.manifest import FileManifest, file_entry
+
+
+def test_plan_resumes_partly_read_log(tmp_path, write_log):
+    log = write_log(tmp_path / 'access.log', range(30))
+    files = FileManifest({})
+    files.record(log, file_entry(log, 100))
+    assert files.plan(log) == ('resume', 100)
+
+
+def test_lines_appended_before_flush_are_read(tmp_path, write_log):
+    log = write_log(tmp_path / 'access.log', range(100))
+    dataset = str(tmp_path / 'dataset')
+    follower = LogFollower(LogData(dataset), [log],
+                           flush_rows=10 ** 6, flush_interval=10 ** 6)
+    follower.poll()
+    # Appended after the poll that read the log, but before the flush.
+    write_log(log, range(100, 110), mode='a')
+    follower.flush()
+
+    logdata = LogData(dataset)
+    logdata.read_logs([log])
+    logdata.write_dataset()
+    assert len(LogData(dataset).data.index) == 110
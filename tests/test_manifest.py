@@ -0,0 +1,73 @@
+import os
+from conmets.conmets import LogData
+from conmets.manifest import FileManifest, file_entry
+
+
+def rotate(log):
+    '''Rotate log as logrotate does: rename it, then create a new, empty
+    log under the old name.'''
+    os.rename(log, f'{log}.1')
+    open(log, 'w').close()
+    return f'{log}.1'
+
+
+def test_plan_unchanged_and_grown(tmp_path, write_log):
+    log = write_log(tmp_path / 'access.log', range(30))
+    files = FileManifest({})
+    files.record(log, file_entry(log, os.path.getsize(log)))
+    assert files.plan(log)[0] == 'skip'
+    size = os.path.getsize(log)
+    write_log(log, range(30, 40), mode='a')
+    assert files.plan(log) == ('resume', size)
+
+
+def test_plan_truncated(tmp_path, write_log):
+    log = write_log(tmp_path / 'access.log', range(30))
+    files = FileManifest({})
+    files.record(log, file_entry(log, os.path.getsize(log)))
+    write_log(log, range(100, 105))
+    assert files.plan(log) == ('read', 0)
+
+
+def test_plan_rename_and_recreate(tmp_path, write_log):
+    log = write_log(tmp_path / 'access.log', range(30))
+    size = os.path.getsize(log)
+    files = FileManifest({})
+    files.record(log, file_entry(log, size))
+    write_log(log, range(30, 40), mode='a')
+    rotated = rotate(log)
+    write_log(log, range(40, 45), mode='a')
+    # The new log is read afresh whether it is planned before or after the
+    # rotated one; the rotated one resumes under its new name.
+    assert files.plan(log) == ('read', 0)
+    assert files.plan(rotated) == ('resume', size)
+    assert os.path.abspath(rotated) in files.entries
+
+
+def test_plan_rename_and_recreate_rotated_first(tmp_path, write_log):
+    log = write_log(tmp_path / 'access.log', range(30))
+    size = os.path.getsize(log)
+    files = FileManifest({})
+    files.record(log, file_entry(log, size))
+    rotated = rotate(log)
+    assert files.plan(rotated) == ('skip', size)
+    assert files.plan(log) == ('read', 0)
+
+
+def test_rotated_log_is_not_read_again(tmp_path, write_log):
+    log = write_log(tmp_path / 'access.log', range(300))
+    dataset = str(tmp_path / 'dataset')
+    logdata = LogData(dataset)
+    logdata.read_logs([log])
+    logdata.write_dataset()
+
+    write_log(log, range(300, 400), mode='a')
+    rotated = rotate(log)
+    write_log(log, range(400, 450), mode='a')
+    logdata = LogData(dataset)
+    logdata.read_logs([log, rotated])
+    logdata.write_dataset()
+    # Only the appended lines of the rotated log were parsed.
+    assert logdata.metrics.stages['parse']['rows_in'] == 150
+    assert logdata.metrics.counters.get('duplicate_rows', 0) == 0
+    assert len(LogData(dataset).data.index) == 450
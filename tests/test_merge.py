@@ -0,0 +1,75 @@
+import json
+import os
+from conmets.conmets import LogData
+from conmets.main import digest, merge
+
+
+def manifest(dataset):
+    with open(os.path.join(dataset, 'manifest.json')) as f:
+        return json.load(f)
+
+
+def nodes(tmp_path, write_log):
+    '''Two machines' logs, the second holding a copy of one of the
+    first's and, in another log, some of the same transactions.'''
+    node1 = tmp_path / 'node1'
+    node2 = tmp_path / 'node2'
+    node1.mkdir()
+    node2.mkdir()
+    logs1 = [write_log(node1 / 'access.log-20191001', range(0, 200)),
+             write_log(node1 / 'access.log-20191002', range(1000, 1200),
+                       day=2)]
+    logs2 = [write_log(node2 / 'access.log-20191002', range(1000, 1200),
+                       day=2),
+             write_log(node2 / 'access.log-20191003', range(2000, 2200),
+                       day=3),
+             write_log(node2 / 'access.log-extra', range(100, 300))]
+    return (str(node1 / 'partial'), logs1), (str(node2 / 'partial'), logs2)
+
+
+def test_merge_partials(tmp_path, write_log, config, classifier, capsys):
+    (partial1, logs1), (partial2, logs2) = nodes(tmp_path, write_log)
+    digest([partial1] + logs1)
+    digest([partial2] + logs2)
+    dataset = str(tmp_path / 'dataset')
+    merge([dataset, partial1, partial2, '--config', config])
+
+    logdata = LogData(dataset, classifier=classifier)
+    # 200 + 200 + 200 distinct from 1 Oct and 100 more from the extra log.
+    assert len(logdata.data.index) == 700
+    assert not logdata.data.duplicated(
+        ['ipaddress', 'timestamp', 'path', 'size']).any()
+    hashes = manifest(dataset)['file_hashes']
+    assert set(hashes) == (set(manifest(partial1)['file_hashes']) |
+                           set(manifest(partial2)['file_hashes']))
+    assert len(hashes) == 4
+    # The rollup tables were kept up to date.
+    assert logdata.rollups_valid()
+    assert logdata.read_rollups()['names']['downloads'].sum() == 700
+    assert 'Rebuilding' not in capsys.readouterr().out
+
+
+def test_merge_again_reads_only_new_parts(tmp_path, write_log, capsys):
+    (partial1, logs1), (partial2, logs2) = nodes(tmp_path, write_log)
+    digest([partial1] + logs1)
+    dataset = str(tmp_path / 'dataset')
+    merge([dataset, partial1])
+    merge([dataset, partial1])
+    assert 'Merging 0 new part files' in capsys.readouterr().out
+
+    digest([partial1, write_log(tmp_path / 'node1' / 'access.log-20191005',
+                                range(5000, 5050), day=5)])
+    merge([dataset, partial1])
+    assert 'Merging 1 new part files (50 transactions)' in \
+        capsys.readouterr().out
+    assert len(LogData(dataset).data.index) == 450
+
+
+def test_merged_logs_are_not_ingested_again(tmp_path, write_log):
+    (partial1, logs1), _ = nodes(tmp_path, write_log)
+    digest([partial1] + logs1)
+    dataset = str(tmp_path / 'dataset')
+    merge([dataset, partial1])
+    logdata = LogData(dataset)
+    logdata.read_logs(logs1)
+    assert logdata.newdata == []
@@ -0,0 +1,96 @@
+import json
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+import pytest
+from conmets.pypi import PyPICache
+
+# Status returned by the stand-in index for each package name. Names not
+# listed are not found.
+STATUSES = {'astropy': 200, 'numpy': 200, 'busy': 429, 'broken': 503}
+
+
+class IndexHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        # Requests are for /pypi/<name>/json.
+        name = self.path.strip('/').split('/')[-2]
+        self.server.requests.append(name)
+        status = STATUSES.get(name, 404)
+        self.send_response(status)
+        self.end_headers()
+        if status == 200:
+            self.wfile.write(json.dumps({'info': {'name': name}}).encode())
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def index():
+    '''URL of a local stand-in for the PyPI JSON API, and the list of names
+    requested from it.'''
+    server = HTTPServer(('127.0.0.1', 0), IndexHandler)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_port}/pypi', server.requests
+    server.shutdown()
+    server.server_close()
+
+
+def test_lookup(tmp_path, index):
+    url, requests = index
+    cache = PyPICache(str(tmp_path / 'cache.json'), index_url=url)
+    found = cache.lookup(['astropy', 'calcos', 'numpy', 'astropy'])
+    assert found == {'astropy': True, 'calcos': False, 'numpy': True}
+    assert sorted(requests) == ['astropy', 'calcos', 'numpy']
+    assert cache.queries == 3
+
+
+def test_cached_results_are_reused(tmp_path, index):
+    url, requests = index
+    path = str(tmp_path / 'cache.json')
+    PyPICache(path, index_url=url).lookup(['astropy', 'calcos'])
+    cache = PyPICache(path, index_url=url)
+    assert cache.lookup(['astropy', 'calcos']) == {'astropy': True,
+                                                   'calcos': False}
+    assert cache.queries == 0
+    assert len(requests) == 2
+
+
+def test_expired_results_are_refreshed(tmp_path, index):
+    url, requests = index
+    path = str(tmp_path / 'cache.json')
+    PyPICache(path, index_url=url).lookup(['astropy'])
+    cache = PyPICache(path, index_url=url, ttl=-1)
+    cache.lookup(['astropy'])
+    assert cache.queries == 1
+    assert requests == ['astropy', 'astropy']
+
+
+@pytest.mark.parametrize('name', ['busy', 'broken'])
+def test_error_statuses_are_retried(tmp_path, index, name):
+    url, requests = index
+    path = str(tmp_path / 'cache.json')
+    cache = PyPICache(path, index_url=url)
+    assert cache.lookup([name]) == {name: False}
+    assert name not in cache.cache
+    PyPICache(path, index_url=url).lookup([name])
+    assert requests == [name, name]
+
+
+def test_unreachable_index_is_not_cached(tmp_path):
+    cache = PyPICache(str(tmp_path / 'cache.json'),
+                      index_url='http://127.0.0.1:9/pypi', timeout=1)
+    assert cache.lookup(['astropy']) == {'astropy': False}
+    assert cache.cache == {}
+
+
+def test_offline(tmp_path, index):
+    url, requests = index
+    path = str(tmp_path / 'cache.json')
+    PyPICache(path, index_url=url).lookup(['astropy'])
+    cache = PyPICache(path, index_url=url, ttl=-1, offline=True)
+    assert cache.lookup(['astropy', 'numpy']) == {'astropy': True,
+                                                  'numpy': False}
+    assert requests == ['astropy']
@@ -0,0 +1,91 @@
+import os
+import pytest
+from conmets.conmets import LogData
+from conmets.store import DatasetStore
+from conmets.query import QueryCache, MEASURES, aggregate_raw, query_frame
+
+
+def ingest(dataset, logs, classifier=None):
+    logdata = LogData(dataset, classifier=classifier)
+    logdata.read_logs(logs)
+    logdata.write_dataset()
+    return logdata
+
+
+@pytest.fixture
+def dataset(tmp_path, write_log, classifier):
+    logs = [write_log(tmp_path / f'access.log-201910{day:02d}',
+                      range(day * 1000, day * 1000 + 300), day=day)
+            for day in (1, 2, 3)]
+    path = str(tmp_path / 'dataset')
+    ingest(path, logs, classifier)
+    return path
+
+
+def raw_answer(logdata, by=(), start=None, end=None, measures=MEASURES,
+               **filters):
+    data = logdata.data
+    if start is not None:
+        data = logdata.read_window(start, end)
+    filters = {'channel': filters.get('channels'),
+               'host_class': filters.get('host_classes'),
+               'name': filters.get('names')}
+    return aggregate_raw(query_frame(data, logdata.classifier), list(by),
+                         filters, list(measures))
+
+
+@pytest.mark.parametrize('params', [
+    {},
+    {'by': ['channel']},
+    {'by': ['date', 'host_class'], 'channels': ['astroconda']},
+    {'by': ['name'], 'start': '2019-10-02', 'end': '2019-10-03',
+     'measures': ['downloads', 'bytes']},
+    {'by': ['host_class'], 'measures': ['downloads', 'unique_hosts']},
+    # Distinct hosts per name are not in the rollup tables.
+    {'by': ['name'], 'host_classes': ['offsite']},
+])
+def test_query_matches_transaction_data(dataset, classifier, params):
+    logdata = LogData(dataset, classifier=classifier)
+    assert logdata.query(**params).equals(raw_answer(logdata, **params))
+
+
+def test_results_are_cached(dataset, classifier, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    logdata = LogData(dataset, classifier=classifier,
+                      query_cache=QueryCache(cache_dir=cache_dir))
+    first = logdata.query(by=['channel'])
+    assert logdata.query(by=['channel']).equals(first)
+    assert logdata.query_cache.hits == 1
+    # A new LogData finds the result on disk.
+    logdata = LogData(dataset, classifier=classifier,
+                      query_cache=QueryCache(cache_dir=cache_dir))
+    assert logdata.query(by=['channel']).equals(first)
+    assert logdata.query_cache.hits == 1
+    assert logdata.metrics.stages.get('query') is None
+
+
+def test_writes_by_others_invalidate_results(dataset, classifier, tmp_path,
+                                             write_log):
+    logdata = LogData(dataset, classifier=classifier)
+    assert logdata.query()['downloads'].iloc[0] == 900
+    # Written without a classifier, leaving the rollup tables out of date.
+    ingest(dataset, [write_log(tmp_path / 'access.log-20191004',
+                               range(4000, 4100), day=4)])
+    assert logdata.query()['downloads'].iloc[0] == 1000
+    assert logdata.query(by=['date'])['downloads'].tolist() == [300] * 3 + [100]
+
+
+def test_query_does_not_write(dataset, classifier, tmp_path, write_log):
+    # Out of date rollup tables are not rebuilt, and unwritten data is
+    # neither written nor counted.
+    ingest(dataset, [write_log(tmp_path / 'access.log-20191004',
+                               range(4000, 4100), day=4)])
+    logdata = LogData(dataset, classifier=classifier)
+    logdata.read_logs([write_log(tmp_path / 'access.log-20191005',
+                                 range(5000, 5100), day=5)])
+    manifest = os.path.join(dataset, 'manifest.json')
+    before = os.stat(manifest).st_mtime_ns
+    assert logdata.query()['downloads'].iloc[0] == 1000
+    assert os.stat(manifest).st_mtime_ns == before
+    assert DatasetStore(dataset).rollups_fingerprint() is None
+    assert len(logdata.newdata) == 1
@@ -0,0 +1,107 @@
+import sys
+import time
+import subprocess
+import threading
+from conmets.resolver import HostnameResolver, UNRESOLVED
+
+HOSTS = {'10.1.0.1': 'build1.example.org', '10.1.0.2': 'build2.example.org'}
+
+
+class StubBackend():
+    '''Resolves the addresses in HOSTS, failing for any other, and
+    records each address looked up.'''
+
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, ip):
+        with self.lock:
+            self.calls.append(ip)
+        try:
+            return HOSTS[ip]
+        except(KeyError):
+            raise OSError(f'no hostname for {ip}')
+
+
+class Clock():
+    '''Stand-in for time.time that only moves when told to.'''
+
+    def __init__(self):
+        self.now = 1.0e9
+
+    def __call__(self):
+        return self.now
+
+
+def test_resolve(tmp_path):
+    backend = StubBackend()
+    resolver = HostnameResolver(str(tmp_path / 'hosts.json'), backend=backend)
+    names = resolver.resolve(['10.1.0.1', '8.8.8.8', '10.1.0.1'])
+    assert names == {'10.1.0.1': 'build1.example.org', '8.8.8.8': UNRESOLVED}
+    assert sorted(backend.calls) == ['10.1.0.1', '8.8.8.8']
+
+
+def test_results_are_cached_on_disk(tmp_path):
+    path = str(tmp_path / 'hosts.json')
+    HostnameResolver(path, backend=StubBackend()).resolve(['10.1.0.2',
+                                                           '8.8.8.8'])
+    backend = StubBackend()
+    resolver = HostnameResolver(path, backend=backend)
+    assert resolver.resolve(['10.1.0.2', '8.8.8.8']) == {
+        '10.1.0.2': 'build2.example.org', '8.8.8.8': UNRESOLVED}
+    assert backend.calls == []
+    assert resolver.queries == 0
+
+
+def test_ttl_expiry(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(time, 'time', clock)
+    backend = StubBackend()
+    resolver = HostnameResolver(str(tmp_path / 'hosts.json'), backend=backend,
+                                ttl=100, negative_ttl=10)
+    resolver.resolve(['10.1.0.1', '8.8.8.8'])
+    # Within the negative TTL nothing is looked up again.
+    clock.now += 5
+    resolver.resolve(['10.1.0.1', '8.8.8.8'])
+    assert len(backend.calls) == 2
+    # Past it only the failure is retried.
+    clock.now += 10
+    resolver.resolve(['10.1.0.1', '8.8.8.8'])
+    assert backend.calls[2:] == ['8.8.8.8']
+    # Past the TTL of successful lookups both are.
+    clock.now += 100
+    resolver.resolve(['10.1.0.1', '8.8.8.8'])
+    assert sorted(backend.calls[3:]) == ['10.1.0.1', '8.8.8.8']
+
+
+def test_hung_lookups_time_out(tmp_path):
+    release = threading.Event()
+
+    def backend(ip):
+        if ip == '10.9.9.9':
+            release.wait(10)
+        return HOSTS.get(ip, 'other.example.org')
+
+    resolver = HostnameResolver(str(tmp_path / 'hosts.json'), backend=backend,
+                                max_workers=2, timeout=0.2)
+    t0 = time.perf_counter()
+    names = resolver.resolve(['10.1.0.1', '10.9.9.9'])
+    release.set()
+    assert time.perf_counter() - t0 < 5
+    assert names == {'10.1.0.1': 'build1.example.org', '10.9.9.9': UNRESOLVED}
+
+
+def test_hung_lookups_do_not_delay_exit(tmp_path):
+    script = ('import time\n'
+              'from conmets.resolver import HostnameResolver\n'
+              'def backend(ip):\n'
+              '    time.sleep(60)\n'
+              f'resolver = HostnameResolver({str(tmp_path / "hosts.json")!r},\n'
+              '                            backend=backend, timeout=0.2)\n'
+              'print(resolver.resolve(["10.9.9.9"]))\n')
+    t0 = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', script],
+                            capture_output=True, text=True, timeout=30)
+    assert time.perf_counter() - t0 < 20
+    assert "'10.9.9.9': 'offline'" in result.stdout
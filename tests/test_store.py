@@ -0,0 +1,100 @@
+import os
+import shutil
+import pandas as pd
+from conmets.conmets import LogData
+from conmets.store import COMPACT_PARTS
+
+
+def make_dataset(tmp_path, write_log, classifier, days=(1, 2, 3)):
+    logs = [write_log(tmp_path / f'access.log-201910{day:02d}',
+                      range(day * 1000, day * 1000 + 100), day=day)
+            for day in days]
+    dataset = str(tmp_path / 'dataset')
+    logdata = LogData(dataset, classifier=classifier)
+    logdata.read_logs(logs)
+    logdata.write_dataset()
+    return dataset
+
+
+def test_rollup_window_reads_only_its_dates(tmp_path, write_log, classifier):
+    dataset = make_dataset(tmp_path, write_log, classifier)
+    # Parts of dates outside the window are never opened.
+    for table in ['names', 'hosts', 'paths', 'sketches']:
+        for date in ['2019-10-01', '2019-10-03']:
+            shutil.rmtree(os.path.join(dataset, 'rollups', table,
+                                       f'date={date}'))
+    logdata = LogData(dataset, classifier=classifier)
+    rollups = logdata.read_rollups('2019-10-02', '2019-10-02')
+    assert rollups['names']['downloads'].sum() == 100
+    assert set(rollups['names']['date']) == {pd.Timestamp('2019-10-02')}
+
+
+def parquet_files(root):
+    return sorted(os.path.relpath(os.path.join(d, f), root)
+                  for d, _, files in os.walk(root)
+                  for f in files if f.endswith('.parquet'))
+
+
+def test_small_appends_are_compacted(tmp_path, write_log, classifier):
+    log = str(tmp_path / 'access.log')
+    dataset = str(tmp_path / 'dataset')
+    logdata = LogData(dataset, classifier=classifier)
+    nwrites = COMPACT_PARTS + 8
+    for i in range(nwrites):
+        write_log(log, range(i * 10, i * 10 + 10), mode='a')
+        logdata.read_logs([log])
+        logdata.write_dataset()
+
+    manifest = logdata.store.manifest
+    assert len(manifest['partitions']['2019-10-01']) <= COMPACT_PARTS
+    for table, dates in manifest['rollups']['parts'].items():
+        assert len(dates['2019-10-01']) <= COMPACT_PARTS
+    # Replaced parts are removed; only those in the manifest remain.
+    listed = sorted(
+        [os.path.join('date=2019-10-01', p)
+         for p in manifest['partitions']['2019-10-01']] +
+        [os.path.join('rollups', table, 'date=2019-10-01', p)
+         for table, dates in manifest['rollups']['parts'].items()
+         for p in dates['2019-10-01']])
+    assert parquet_files(dataset) == listed
+
+    logdata = LogData(dataset, classifier=classifier)
+    assert len(logdata.data.index) == nwrites * 10
+    rollups = logdata.read_rollups()
+    assert rollups['names']['downloads'].sum() == nwrites * 10
+    assert rollups['hosts']['ipaddress'].nunique() == nwrites * 10
+
+
+def test_interleaved_writers(tmp_path, write_log, classifier):
+    dataset = make_dataset(tmp_path, write_log, classifier, days=(1,))
+    # Two processes open the dataset, then each adds different rows of the
+    # same date and writes in turn.
+    first = LogData(dataset, classifier=classifier)
+    second = LogData(dataset, classifier=classifier)
+    log1 = write_log(tmp_path / 'a.log', range(5000, 5050))
+    log2 = write_log(tmp_path / 'b.log', range(6000, 6070))
+    first.read_logs([log1])
+    second.read_logs([log2])
+    first.write_dataset()
+    second.write_dataset()
+
+    logdata = LogData(dataset, classifier=classifier)
+    assert len(logdata.data.index) == 220
+    assert len(logdata.store.manifest['file_hashes']) == 3
+    assert logdata.read_rollups()['names']['downloads'].sum() == 220
+    listed = logdata.store.manifest['partitions']['2019-10-01']
+    assert len(set(listed)) == len(listed)
+    # Rows written by either are known to the row index of both.
+    first.read_logs([write_log(tmp_path / 'c.log', range(6000, 6010))])
+    first.write_dataset()
+    assert len(LogData(dataset).data.index) == 220
+
+
+def test_nothing_to_write(tmp_path, write_log, classifier):
+    dataset = make_dataset(tmp_path, write_log, classifier, days=(1,))
+    manifest = os.path.join(dataset, 'manifest.json')
+    before = os.stat(manifest).st_mtime_ns
+    logdata = LogData(dataset, classifier=classifier)
+    logdata.read_logs([str(tmp_path / 'access.log-20191001')])
+    logdata.write_dataset()
+    assert os.stat(manifest).st_mtime_ns == before